@@ -7,11 +7,13 @@
 - записывает статистику при обнаружении отслеживаемых звуков
 """
 
+import fcntl
+import os
+import selectors
 import subprocess
+import sys
 import threading
 import time
-import traceback
-from collections import deque
 
 import numpy as np
 
@@ -21,39 +23,238 @@ from mqtt_client import send_sound_detected
 from presence_tracker import get_tracker
 from utils import log
 
+try:
+    from numba import njit
+except ImportError:  # numba опционален: без него гейт тишины считается через NumPy
+    njit = None
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _rms_i16(buf):
+        """RMS int16-окна без промежуточного float32-массива."""
+        s = 0.0
+        for i in range(buf.shape[0]):
+            x = float(buf[i])
+            s += x * x
+        return (s / buf.shape[0]) ** 0.5
+else:
+    _rms_i16 = None
+
+# Раз в сколько секунд писать в лог статистику кэша результатов YAMNet
+_CACHE_STATS_INTERVAL = 600.0
+
+
+class _SoundEvents:
+    """Обработка обнаруженных звуков: анти-спам, лог, статистика, MQTT, трекер присутствия."""
 
-class AudioDetector:
     def __init__(self):
+        self._enabled = False  # Детекция начнётся только после enable()
+        self._current_frame = 0  # Номер текущего кадра (обновляется из main.py)
+
+        # Анти-спам по времени
+        self.min_interval_sec = 5.0
+        self._last_event_ts = 0.0
+        self._last_detected_sound = None
+
+    def _handle_detection(self, detected_sound: str | None):
+        """Логирует звук, пишет статистику и шлёт события (с анти-спамом по времени)."""
+        # Логируем и записываем статистику только если детекция включена
+        if detected_sound and self._enabled:
+            now = time.time()
+            if (now - self._last_event_ts) > self.min_interval_sec or \
+               self._last_detected_sound != detected_sound:
+                self._last_event_ts = now
+                self._last_detected_sound = detected_sound
+                frame_info = f" (кадр {self._current_frame})" if self._current_frame > 0 else ""
+                log(f"🔊 Обнаружен звук: {detected_sound}{frame_info}")
+                stats.record_sound_detected(detected_sound)
+                send_sound_detected(detected_sound, frame=self._current_frame)
+                
+                # Уведомляем трекер присутствия (для звуков двери)
+                tracker = get_tracker()
+                if tracker:
+                    tracker.on_door_sound(detected_sound)
+
+    def enable(self):
+        """Включает детекцию звуков (вызывать после завершения инициализации)."""
+        self._enabled = True
+
+    def set_frame(self, frame_num: int):
+        """Обновляет номер текущего кадра (для логирования)."""
+        self._current_frame = frame_num
+
+
+class AudioDetector(_SoundEvents):
+    def __init__(self, event_queue=None):
+        super().__init__()
         classes = ', '.join(config.YAMNET_CLASSES) if config.YAMNET_CLASSES else 'все'
         log(f"🎧 Инициализация системы распознавания звуков YAMNet: {classes}")
         
         self.proc: subprocess.Popen | None = None
+        self._owns_proc = False  # False — процесс принадлежит видеопотоку (SHARED_FFMPEG)
         self._stop = False
-        self._enabled = False  # Детекция начнётся только после enable()
-        self._current_frame = 0  # Номер текущего кадра (обновляется из main.py)
+        # В отдельном процессе звуки не обрабатываются здесь, а уходят в очередь основного процесса
+        self._event_queue = event_queue
+
+        # Кольцевой буфер для накопления аудио (int16, без поэлементного копирования)
+        self.yamnet_window_size = 15680
+        # Родной режим YAMNet: окна 0.96 с с перекрытием 50%.
+        # За один вызов модели отдаём yamnet_batch окон одним отрезком.
+        self.yamnet_hop = self.yamnet_window_size // 2
+        self.yamnet_batch = config.YAMNET_BATCH
+        self.yamnet_span = self.yamnet_window_size + (self.yamnet_batch - 1) * self.yamnet_hop
+        # Сколько новых сэмплов между вызовами модели (YAMNET_INFER_HOP_MS)
+        self.infer_every = max(1, int(config.AUDIO_SAMPLE_RATE * config.YAMNET_INFER_HOP_MS / 1000))
+        self._buf = np.zeros(
+            max(self.yamnet_window_size * 2, self.yamnet_span + self.yamnet_hop), dtype=np.int16
+        )
+        self._buf_write = 0   # позиция записи в кольце
+        self._buf_filled = 0  # сколько сэмплов уже накоплено
+        self._since_infer = 0  # сэмплов с момента последнего вызова модели
+        # Непрерывный отрезок для YAMNet (заполняется из кольца двумя срезами)
+        self._window = np.empty(self.yamnet_span, dtype=np.int16)
+        # Scratch-буфер float32 для нормализации (без временных массивов на каждый вызов)
+        self._norm_scratch = np.empty(self.yamnet_span, dtype=np.float32)
+        # Передача отрезка от потока чтения к потоку инференса
+        self._window_lock = threading.Lock()
+        self._window_ready = threading.Event()
 
         # YAMNet настройки
         self.yamnet_model = None
         self.yamnet_class_names = None
-        
-        # Пробуем загрузить TensorFlow и YAMNet
+        self._interp = None  # TFLite Interpreter (если используется квантованная модель)
+        self._yamnet_cf = None  # скомпилированная concrete function для SavedModel
+
+        if config.YAMNET_USE_TFLITE:
+            # Сначала официальная квантованная модель, затем наша FP16-конвертация SavedModel
+            for path in (config.YAMNET_TFLITE_PATH, config.YAMNET_FP16_PATH):
+                if os.path.exists(path):
+                    self._load_tflite(path)
+                if self._interp is not None:
+                    break
+        if self._interp is None:
+            self._load_saved_model()
+        self._build_tracked_mask()
+
+        # Кэш последнего результата по отпечатку окна — энергиям (дБ) 16 полос, равномерных
+        # по логарифмической шкале частот, как mel (стационарный фон — гул холодильника, ТВ —
+        # не гоняем через модель повторно)
+        n_freq = self.yamnet_span // 2 + 1
+        hz_per_bin = config.AUDIO_SAMPLE_RATE / self.yamnet_span
+        edges = np.geomspace(60.0, config.AUDIO_SAMPLE_RATE / 2, 17)[:-1] / hz_per_bin
+        self._fp_edges = np.unique(np.clip(edges.astype(np.intp), 1, n_freq - 1))
+        self._last_fp: np.ndarray | None = None
+        self._last_fp_ts = 0.0
+        self._last_sound: str | None = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # Порог уверенности для классификации
+        self.confidence_threshold = 0.3
+
+    # ----------------------------------------------------
+    def _load_tflite(self, path: str):
+        """Загружает TFLite-модель YAMNet (квантованную с входом 15600 сэмплов или FP16-конвертацию)."""
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            try:
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+            except ImportError:
+                log("⚠️ tflite_runtime не установлен, использую SavedModel YAMNet")
+                return
+
+        try:
+            log(f"   Загрузка модели YAMNet (TFLite): {path}")
+            # Float-операции TFLite по умолчанию исполняет делегат XNNPACK
+            interp = Interpreter(
+                model_path=path,
+                num_threads=config.YAMNET_THREADS,
+            )
+            interp.allocate_tensors()
+            self._tflite_input = interp.get_input_details()[0]
+            outputs = interp.get_output_details()
+            # У конвертированной SavedModel три выхода — берём scores (последняя ось 521)
+            self._tflite_output = next(
+                (d for d in outputs if d["shape"][-1] == 521), outputs[0]
+            )
+            self._tflite_frame = int(self._tflite_input["shape"][-1])
+            if self._tflite_frame != self.yamnet_span and self._tflite_frame > self.yamnet_window_size:
+                raise ValueError(
+                    f"вход модели {self._tflite_frame} сэмплов не подходит к YAMNET_BATCH={self.yamnet_batch}"
+                )
+
+            labels_path = path + ".labels.txt"
+            if os.path.exists(labels_path):
+                with open(labels_path, "r", encoding="utf-8") as f:
+                    labels = f.read().splitlines()
+            else:
+                # Названия классов вшиты в .tflite (zip с метаданными)
+                import zipfile
+                with zipfile.ZipFile(path) as zf:
+                    label_file = next(n for n in zf.namelist() if n.endswith(".txt"))
+                    labels = zf.read(label_file).decode("utf-8").splitlines()
+            self.yamnet_class_names = {i: name.strip() for i, name in enumerate(labels)}
+
+            self._interp = interp
+            log("✅ Система распознавания звуков YAMNet готова (TFLite)")
+        except Exception as e:
+            log(f"⚠️ Не удалось загрузить YAMNet TFLite ({e}), использую SavedModel")
+            self._interp = None
+
+    def _load_saved_model(self):
+        """Загружает полную SavedModel YAMNet через TensorFlow Hub."""
         hub = None
         yamnet_available = False
         
+        # Кэш TF Hub в постоянном томе моделей: без повторной загрузки при каждом рестарте.
+        # Права 0700 — чтобы подменить кэшированную модель мог только владелец.
+        os.makedirs(config.TFHUB_CACHE_DIR, mode=0o700, exist_ok=True)
+        os.environ.setdefault("TFHUB_CACHE_DIR", config.TFHUB_CACHE_DIR)
+
+        # Вход YAMNet маленький: по умолчанию TF раскидывает каждый вызов на все ядра
+        # и отбирает их у YOLO. Ограничиваем пул потоков TF до импорта.
+        os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+        os.environ.setdefault("TF_NUM_INTRAOP_THREADS", str(config.YAMNET_THREADS))
+
         try:
             log("   Загрузка TensorFlow...")
             import tensorflow as tf
             import tensorflow_hub as hub
+            try:
+                tf.config.threading.set_inter_op_parallelism_threads(1)
+                tf.config.threading.set_intra_op_parallelism_threads(config.YAMNET_THREADS)
+            except RuntimeError:
+                pass  # рантайм TF уже инициализирован — остаются значения из окружения
             yamnet_available = True
         except ImportError:
             log("⚠️ TensorFlow не установлен, детекция звуков недоступна")
         except Exception as e:
             log(f"⚠️ Ошибка импорта TensorFlow: {e}")
-    
+
         if yamnet_available and hub is not None:
             try:
-                log("   Загрузка модели YAMNet...")
-                self.yamnet_model = hub.load('https://tfhub.dev/google/yamnet/1')
+                if os.path.exists(os.path.join(config.YAMNET_LOCAL_DIR, "saved_model.pb")):
+                    log(f"   Загрузка модели YAMNet из локального кэша: {config.YAMNET_LOCAL_DIR}")
+                    self.yamnet_model = tf.saved_model.load(config.YAMNET_LOCAL_DIR)
+                else:
+                    log("   Загрузка модели YAMNet (TF Hub, кэш пуст)...")
+                    self.yamnet_model = hub.load('https://tfhub.dev/google/yamnet/1')
+                    try:
+                        tf.saved_model.save(self.yamnet_model, config.YAMNET_LOCAL_DIR)
+                        log(f"   YAMNet сохранена в локальный кэш: {config.YAMNET_LOCAL_DIR}")
+                    except Exception as e:
+                        log(f"⚠️ Не удалось сохранить YAMNet в кэш: {e}")
+                # Один раз трассируем граф под фиксированную длину отрезка,
+                # чтобы не проходить диспетчеризацию SavedModel на каждом вызове.
+                # Возвращаем только scores: embeddings/spectrogram не выходят из графа
+                self._tf = tf
+                self._yamnet_cf = tf.function(
+                    lambda x: self.yamnet_model(x)[0],
+                    input_signature=[tf.TensorSpec([self.yamnet_span], tf.float32)],
+                ).get_concrete_function()
                 
                 # Загружаем названия классов YAMNet
                 import csv
@@ -71,25 +272,54 @@ class AudioDetector:
                                 continue
                 self.yamnet_class_names = class_names
                 log("✅ Система распознавания звуков YAMNet готова")
+
+                if config.YAMNET_USE_TFLITE and not os.path.exists(config.YAMNET_FP16_PATH):
+                    self._export_fp16_tflite(tf)
             except Exception as e:
                 log(f"❌ Не удалось загрузить YAMNet: {e}")
                 self.yamnet_model = None
 
-        # Буфер для накопления аудио
-        self.yamnet_window_size = 15680
-        self.audio_buffer = deque(maxlen=self.yamnet_window_size * 2)
-        
-        # Порог уверенности для классификации
-        self.confidence_threshold = 0.3
+    def _export_fp16_tflite(self, tf):
+        """Один раз конвертирует SavedModel в TFLite с весами FP16 (используется со следующего старта)."""
+        try:
+            converter = tf.lite.TFLiteConverter.from_concrete_functions(
+                [self._yamnet_cf], self.yamnet_model
+            )
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+            tflite_model = converter.convert()
 
-        # Анти-спам по времени
-        self.min_interval_sec = 5.0
-        self._last_event_ts = 0.0
-        self._last_detected_sound = None
+            with open(config.YAMNET_FP16_PATH, "wb") as f:
+                f.write(tflite_model)
+            n_classes = max(self.yamnet_class_names) + 1
+            with open(config.YAMNET_FP16_PATH + ".labels.txt", "w", encoding="utf-8") as f:
+                f.write("\n".join(self.yamnet_class_names.get(i, "") for i in range(n_classes)))
+            log(f"   YAMNet сконвертирована в TFLite FP16: {config.YAMNET_FP16_PATH}")
+        except Exception as e:
+            log(f"⚠️ Не удалось сконвертировать YAMNet в TFLite FP16: {e}")
 
     # ----------------------------------------------------
+    def _attach_shared_ffmpeg(self):
+        """Подключается к stdout общего ffmpeg видеопотока (SHARED_FFMPEG) вместо своего процесса."""
+        # camera (OpenCV, PyAV) нужна только здесь — процесс AUDIO_PROCESS её не импортирует
+        from camera import get_shared_audio_capture
+
+        for _ in range(30):
+            cap = get_shared_audio_capture()
+            if cap is not None:
+                self.proc = cap.proc
+                self._owns_proc = False
+                return
+            time.sleep(1.0)
+        log("❌ Общий ffmpeg видеопотока не найден")
+        self.proc = None
+
     def _start_ffmpeg(self):
         """Запускает ffmpeg, который достаёт аудио из RTSP и выдаёт сырое PCM в stdout."""
+        if config.SHARED_FFMPEG:
+            self._attach_shared_ffmpeg()
+            return
+
         src = str(config.VIDEO_URL)
 
         cmd = [
@@ -114,6 +344,7 @@ class AudioDetector:
                 stderr=subprocess.PIPE,
                 bufsize=4096,
             )
+            self._owns_proc = True
             
             time.sleep(2.0)
             if self.proc.poll() is not None:
@@ -131,132 +362,350 @@ class AudioDetector:
             self.proc = None
 
     # ----------------------------------------------------
+    def _has_model(self) -> bool:
+        return self._interp is not None or self.yamnet_model is not None
+
+    def _run_yamnet(self, audio_float: np.ndarray) -> np.ndarray:
+        """Прогоняет отрезок через YAMNet, возвращает scores формы (frames, 521)."""
+        if self._interp is None:
+            scores = self._yamnet_cf(self._tf.constant(audio_float))
+            return scores.numpy()
+
+        inp, out = self._tflite_input, self._tflite_output
+        if self._tflite_frame == self.yamnet_span:
+            # FP16-конвертация под наш отрезок: весь батч за один invoke()
+            self._interp.set_tensor(inp["index"], audio_float.reshape(inp["shape"]))
+            self._interp.invoke()
+            return self._interp.get_tensor(out["index"]).reshape(-1, out["shape"][-1])
+
+        # TFLite: фиксированный вход (15600 сэмплов) — по одному окну на invoke()
+        rows = []
+        for i in range(self.yamnet_batch):
+            start = i * self.yamnet_hop
+            x = audio_float[start:start + self._tflite_frame]
+            if inp["dtype"] != np.float32:
+                scale, zero_point = inp["quantization"]
+                x = np.round(x / scale + zero_point)
+            self._interp.set_tensor(inp["index"], x.astype(inp["dtype"], copy=False).reshape(inp["shape"]))
+            self._interp.invoke()
+            row = self._interp.get_tensor(out["index"]).reshape(-1)
+            if out["dtype"] != np.float32:
+                scale, zero_point = out["quantization"]
+                row = (row.astype(np.float32) - zero_point) * scale
+            rows.append(row)
+        return np.stack(rows)
+
+    def _fingerprint(self, audio_float: np.ndarray) -> np.ndarray:
+        """Отпечаток окна: абсолютная энергия (дБ) в лог-полосах спектра rfft."""
+        power = np.abs(np.fft.rfft(audio_float)) ** 2
+        bands = np.add.reduceat(power, self._fp_edges)
+        return 10.0 * np.log10(bands + 1e-10)
+
+    def cache_stats(self) -> dict:
+        """Статистика кэша результатов YAMNet."""
+        return {"hits": self.cache_hits, "misses": self.cache_misses}
+
+    def _log_cache_stats(self):
+        """Пишет в лог попадания кэша YAMNet (в т.ч. из процесса AUDIO_PROCESS — его log() виден в основном)."""
+        st = self.cache_stats()
+        total = st["hits"] + st["misses"]
+        if total:
+            log(f"🎧 Кэш YAMNet: {st['hits']} попаданий из {total} окон ({100.0 * st['hits'] / total:.0f}%)")
+
+    def _build_tracked_mask(self):
+        """Один раз сопоставляет индексы классов YAMNet с отслеживаемыми ключевыми словами."""
+        n_classes = max(self.yamnet_class_names) + 1 if self.yamnet_class_names else 0
+        self._class_names_arr = np.array(
+            [self.yamnet_class_names.get(i, "") for i in range(n_classes)], dtype=object
+        )
+        self._tracked_mask = np.array(
+            [any(t in name.lower() for t in config.YAMNET_CLASSES) for name in self._class_names_arr],
+            dtype=bool,
+        )
+
+    def _pick_tracked_class(self, scores_mean: np.ndarray) -> str | None:
+        """Возвращает лучший отслеживаемый класс, если он в top-10 и уверенность ≥ 0.1."""
+        n = min(scores_mean.size, self._tracked_mask.size)
+        scores = scores_mean[:n]
+        masked = np.where(self._tracked_mask[:n], scores, -1.0)
+        idx = int(np.argmax(masked))
+        confidence = float(masked[idx])
+        # Низкий порог для всех отслеживаемых звуков; берём только из top-10 по всем классам
+        if confidence < 0.1 or int(np.count_nonzero(scores > confidence)) >= 10:
+            return None
+        return self._class_names_arr[idx]  # Возвращаем оригинальное название класса
+
     def _classify_with_yamnet(self, audio_data: np.ndarray) -> str | None:
         """Классифицирует звук с помощью YAMNet."""
-        if not self.yamnet_model or audio_data.size < self.yamnet_window_size:
+        if not self._has_model() or audio_data.size < self.yamnet_span:
             return None
         
         if not self.yamnet_class_names:
             return None
         
         try:
-            audio_float = audio_data.astype(np.float32) / 32768.0
-            
-            if audio_float.size > self.yamnet_window_size:
-                audio_float = audio_float[:self.yamnet_window_size]
-            elif audio_float.size < self.yamnet_window_size:
-                padding = np.zeros(self.yamnet_window_size - audio_float.size, dtype=np.float32)
-                audio_float = np.concatenate([audio_float, padding])
-            
-            scores, embeddings, spectrogram = self.yamnet_model(audio_float)
-            scores_np = scores.numpy()
+            # Отрезок из кольцевого буфера всегда ровно yamnet_span сэмплов:
+            # int16 → float32 и нормализация одним проходом в готовый буфер
+            audio_float = self._norm_scratch
+            with self._window_lock:
+                # Гейт тишины прямо по int16 (Numba): для тихих окон даже не нормализуем
+                if config.SILENCE_GATE > 0 and _rms_i16 is not None:
+                    if _rms_i16(audio_data[:self.yamnet_span]) < config.SILENCE_GATE * 32768.0:
+                        return None
+                np.multiply(
+                    audio_data[:self.yamnet_span], np.float32(1.0 / 32768.0),
+                    out=audio_float, casting="unsafe",
+                )
+
+            # Гейт тишины без Numba: энергия окна одним скалярным произведением
+            if config.SILENCE_GATE > 0 and _rms_i16 is None:
+                energy = float(np.dot(audio_float, audio_float))
+                if energy < (config.SILENCE_GATE ** 2) * audio_float.size:
+                    return None
+
+            # Энергия ни в одной полосе не изменилась больше чем на YAMNET_CACHE_DB — берём прошлый
+            # результат. Сравнение абсолютное: лай или стук поверх фона поднимает свои полосы и
+            # всегда даёт промах, даже если прошлое окно было тишиной без звука (None)
+            fp = None
+            now = time.time()
+            if config.YAMNET_CACHE_TTL > 0:
+                fp = self._fingerprint(audio_float)
+                if (
+                    self._last_fp is not None
+                    and (now - self._last_fp_ts) < config.YAMNET_CACHE_TTL
+                    and float(np.max(np.abs(fp - self._last_fp))) <= config.YAMNET_CACHE_DB
+                ):
+                    self.cache_hits += 1
+                    return self._last_sound
+                self.cache_misses += 1
+
+            scores_np = self._run_yamnet(audio_float)
             
-            if scores_np.ndim == 2:
+            if scores_np.ndim == 2 and self.yamnet_batch > 1 and config.YAMNET_SCORE_AGG == "max":
+                # Несколько окон за вызов: короткий звук не должен "размываться" соседними окнами
+                scores_mean = np.max(scores_np, axis=0)
+            elif scores_np.ndim == 2:
                 scores_mean = np.mean(scores_np, axis=0)
             else:
                 scores_mean = scores_np
             
-            # Берём top-10 для большего охвата
-            top_indices = np.argsort(scores_mean)[-10:][::-1]
-            
-            for idx in top_indices:
-                if idx >= len(scores_mean):
-                    continue
-                    
-                confidence = float(scores_mean[idx])
-                class_name = self.yamnet_class_names.get(int(idx), "")
-                class_name_lower = class_name.lower()
-                
-                # Проверяем, содержит ли class_name любой из отслеживаемых классов
-                for tracked in config.YAMNET_CLASSES:
-                    if tracked in class_name_lower:
-                        # Низкий порог для всех отслеживаемых звуков
-                        if confidence >= 0.1:
-                            return class_name  # Возвращаем оригинальное название класса
-            
-            return None
+            detected = self._pick_tracked_class(scores_mean)
+            self._last_fp, self._last_fp_ts, self._last_sound = fp, now, detected
+            return detected
         except Exception as e:
             log(f"⚠️ Ошибка классификации YAMNet: {e}")
             return None
 
+    # ----------------------------------------------------
+    def _ring_write(self, pcm: np.ndarray):
+        """Пишет сэмплы в кольцевой буфер (максимум два среза, с переходом через край)."""
+        size = self._buf.size
+        n = pcm.size
+        if n >= size:
+            pcm = pcm[-size:]
+            n = size
+
+        start = self._buf_write
+        first = min(n, size - start)
+        self._buf[start:start + first] = pcm[:first]
+        if first < n:
+            self._buf[:n - first] = pcm[first:]
+
+        self._buf_write = (start + n) % size
+        self._buf_filled = min(size, self._buf_filled + n)
+
+    def _ring_window(self) -> np.ndarray:
+        """Копирует последние yamnet_span сэмплов кольца в непрерывный отрезок."""
+        size = self._buf.size
+        window = self.yamnet_span
+        start = (self._buf_write - window) % size
+        first = min(window, size - start)
+        self._window[:first] = self._buf[start:start + first]
+        if first < window:
+            self._window[first:] = self._buf[:window - first]
+        return self._window
+
     # ----------------------------------------------------
     def _process_chunk(self, chunk: bytes):
         """Обработка одного куска PCM-данных."""
         if not chunk:
             return
 
-        pcm = np.frombuffer(chunk, dtype=np.int16).astype(np.float32)
+        pcm = np.frombuffer(chunk, dtype=np.int16)
         if pcm.size == 0:
             return
 
-        self.audio_buffer.extend(pcm)
-        
-        if len(self.audio_buffer) >= self.yamnet_window_size and self.yamnet_model:
-            audio_array = np.array(list(self.audio_buffer)[-self.yamnet_window_size:])
-            detected_sound = self._classify_with_yamnet(audio_array)
-            
-            # Логируем и записываем статистику только если детекция включена
-            if detected_sound and self._enabled:
-                now = time.time()
-                if (now - self._last_event_ts) > self.min_interval_sec or \
-                   self._last_detected_sound != detected_sound:
-                    self._last_event_ts = now
-                    self._last_detected_sound = detected_sound
-                    frame_info = f" (кадр {self._current_frame})" if self._current_frame > 0 else ""
-                    log(f"🔊 Обнаружен звук: {detected_sound}{frame_info}")
-                    stats.record_sound_detected(detected_sound)
-                    send_sound_detected(detected_sound, frame=self._current_frame)
-                    
-                    # Уведомляем трекер присутствия (для звуков двери)
-                    tracker = get_tracker()
-                    if tracker:
-                        tracker.on_door_sound(detected_sound)
+        self._ring_write(pcm)
+        self._since_infer += pcm.size
+
+        # Модель вызываем раз в YAMNET_INFER_HOP_MS нового аудио
+        if (
+            self._has_model()
+            and self._buf_filled >= self.yamnet_span
+            and self._since_infer >= self.infer_every
+        ):
+            self._since_infer = 0
+            # Отдаём свежий отрезок потоку инференса; чтение пайпа при этом не ждёт модель
+            with self._window_lock:
+                self._ring_window()
+            self._window_ready.set()
+
+    # ----------------------------------------------------
+    def infer_loop(self):
+        """Цикл инференса: ждёт готовый отрезок и классифицирует его."""
+        last_stats_ts = time.time()
+        while not self._stop:
+            if time.time() - last_stats_ts >= _CACHE_STATS_INTERVAL:
+                last_stats_ts = time.time()
+                self._log_cache_stats()
+            if not self._window_ready.wait(timeout=0.5):
+                continue
+            self._window_ready.clear()
+            detected_sound = self._classify_with_yamnet(self._window)
+            if self._event_queue is None:
+                self._handle_detection(detected_sound)
+            elif detected_sound:
+                self._event_queue.put(detected_sound)
 
     # ----------------------------------------------------
     def audio_loop(self):
         """Основной цикл чтения аудио из ffmpeg."""
-        self._start_ffmpeg()
-        if not self.proc or not self.proc.stdout:
-            log("❌ Не удалось запустить ffmpeg для аудио")
-            return
-
-        chunk_size = 4096
-        
         while not self._stop:
-            try:
-                if self.proc.poll() is not None:
-                    log(f"❌ ffmpeg завершился с кодом {self.proc.returncode}")
+            self._start_ffmpeg()
+            if self.proc and self.proc.stdout:
+                self._read_pipe()
+            else:
+                log("❌ Не удалось запустить ffmpeg для аудио")
+
+            # Общий ffmpeg перезапускается вместе с видеопотоком — переподключаемся к новому
+            if not config.SHARED_FFMPEG:
+                return
+            time.sleep(config.STREAM_RECONNECT_DELAY)
+
+    def _read_pipe(self):
+        """Читает PCM из stdout ffmpeg, пока процесс жив."""
+        # Неблокирующее чтение пайпа: забираем всё, что накопилось, одним os.read()
+        # вместо фиксированных блокирующих кусков по 4096 байт
+        read_size = 65536
+        fd = self.proc.stdout.fileno()
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        sel = selectors.DefaultSelector()
+        sel.register(fd, selectors.EVENT_READ)
+        tail = b""  # нечётный байт (половина int16-сэмпла) до следующего чтения
+
+        try:
+            while not self._stop:
+                try:
+                    if self.proc.poll() is not None:
+                        log(f"❌ ffmpeg завершился с кодом {self.proc.returncode}")
+                        break
+
+                    if not sel.select(timeout=0.5):
+                        continue
+                    try:
+                        data = os.read(fd, read_size)
+                    except BlockingIOError:
+                        continue
+                    if not data:
+                        time.sleep(0.05)
+                        continue
+
+                    if tail:
+                        data = tail + data
+                    if len(data) % 2:
+                        tail, data = data[-1:], data[:-1]
+                    else:
+                        tail = b""
+
+                    self._process_chunk(data)
+                except Exception as e:
+                    log(f"❌ Ошибка в аудиопотоке: {e}")
                     break
-                
-                data = self.proc.stdout.read(chunk_size)
-                if not data:
-                    time.sleep(0.05)
-                    continue
-                
-                self._process_chunk(data)
-            except Exception as e:
-                log(f"❌ Ошибка в аудиопотоке: {e}")
-                break
+        finally:
+            sel.close()
 
     # ----------------------------------------------------
     def start(self):
-        """Запускает аудиодетектор в отдельном потоке."""
+        """Запускает аудиодетектор: чтение ffmpeg и инференс YAMNet в отдельных потоках."""
         t = threading.Thread(target=self.audio_loop, daemon=True, name="AudioDetector")
         t.start()
-
-    def enable(self):
-        """Включает детекцию звуков (вызывать после завершения инициализации)."""
-        self._enabled = True
-
-    def set_frame(self, frame_num: int):
-        """Обновляет номер текущего кадра (для логирования)."""
-        self._current_frame = frame_num
+        t_infer = threading.Thread(target=self.infer_loop, daemon=True, name="AudioDetectorInfer")
+        t_infer.start()
 
     def stop(self):
         """Останавливает аудиодетектор и ffmpeg."""
         self._stop = True
         try:
-            if self.proc:
+            if self.proc and self._owns_proc:
                 self.proc.kill()
         except Exception:
             pass
+
+
+# ============================================================
+# Аудиодетектор в отдельном процессе
+# ============================================================
+class AudioDetectorProcess(_SoundEvents):
+    """
+    YAMNet в отдельном процессе (audio_worker.py), чтобы инференс не конкурировал за GIL с видеопотоком и YOLO.
+    Дочерний процесс отдаёт только названия обнаруженных звуков строками через пайп;
+    в основном процессе их читает небольшой поток (анти-спам, статистика, MQTT).
+    Его log() пишет прямо в stdout основного процесса.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._proc: subprocess.Popen | None = None
+        self._stop = False
+
+    def _events_loop(self, events):
+        """Читает звуки из пайпа дочернего процесса до его завершения."""
+        with events:
+            for line in events:
+                self._handle_detection(line.rstrip("\n"))
+        if not self._stop:
+            log(f"❌ Процесс аудиодетектора завершился с кодом {self._proc.wait()}")
+
+    def start(self):
+        """Запускает процесс аудиодетектора и поток чтения событий."""
+        r, w = os.pipe()
+        worker = os.path.join(os.path.dirname(os.path.abspath(__file__)), "audio_worker.py")
+        # c_silence перенаправил fd 1/2 в /dev/null — отдаём дочернему процессу сохранённые stdout/stderr
+        self._proc = subprocess.Popen(
+            [sys.executable, worker, str(w)],
+            stdin=subprocess.PIPE,
+            stdout=sys.stdout,
+            stderr=sys.stderr,
+            pass_fds=(w,),
+        )
+        os.close(w)
+        log(f"🎧 Аудиодетектор запущен в отдельном процессе (pid {self._proc.pid})")
+        t = threading.Thread(
+            target=self._events_loop, args=(os.fdopen(r, "r"),), daemon=True, name="AudioDetectorEvents"
+        )
+        t.start()
+
+    def stop(self):
+        """Останавливает процесс аудиодетектора (EOF на его stdin)."""
+        self._stop = True
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._proc.wait(timeout=3.0)
+        except subprocess.TimeoutExpired:
+            self._proc.terminate()
+
+
+def create_audio_detector():
+    """
+    Создаёт аудиодетектор: в отдельном процессе (AUDIO_PROCESS) или в потоках текущего.
+    С SHARED_FFMPEG аудио идёт из пайпа видеопотока этого процесса — только потоки.
+    """
+    if config.AUDIO_PROCESS and not config.SHARED_FFMPEG:
+        return AudioDetectorProcess()
+    return AudioDetector()
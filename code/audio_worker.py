@@ -0,0 +1,56 @@
+# audio_worker.py
+"""
+Точка входа процесса аудиодетектора (AUDIO_PROCESS).
+Запускается отдельным интерпретатором из AudioDetectorProcess и импортирует только
+аудиодетектор и config — без torch/YOLO/InsightFace основного процесса.
+stdout/stderr — настоящие stdout/stderr родителя, поэтому log() и traceback видны в логе контейнера.
+Обнаруженные звуки пишутся строками в пайп (номер fd — argv[1]); EOF на stdin — сигнал остановки.
+"""
+
+import c_silence  # noqa: F401  (C-вывод TensorFlow/BLAS — в /dev/null, log() — в stdout)
+
+import os
+import sys
+import traceback
+
+import config
+from audio_detector import AudioDetector
+from utils import log
+
+
+class _PipeEvents:
+    """Очередь событий поверх пайпа к родителю: put(звук) пишет одну строку."""
+
+    def __init__(self, fd: int):
+        self._f = os.fdopen(fd, "w", buffering=1)
+
+    def put(self, detected_sound: str):
+        self._f.write(detected_sound + "\n")
+
+
+def main():
+    # Процесс фоновый: уступаем CPU видеопотоку и YOLO
+    try:
+        os.nice(5)
+    except OSError:
+        pass
+    if config.AUDIO_CPU_AFFINITY:
+        try:
+            os.sched_setaffinity(0, config.AUDIO_CPU_AFFINITY)
+        except (AttributeError, OSError) as e:
+            log(f"⚠️ Не удалось привязать аудиодетектор к CPU {config.AUDIO_CPU_AFFINITY}: {e}")
+
+    try:
+        detector = AudioDetector(event_queue=_PipeEvents(int(sys.argv[1])))
+        detector.start()
+        # Родитель закрывает stdin при остановке (или при своём завершении) — тогда выходим
+        sys.stdin.read()
+        detector.stop()
+    except Exception as e:
+        log(f"❌ Ошибка процесса аудиодетектора: {e}")
+        traceback.print_exc()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
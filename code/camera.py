@@ -4,13 +4,225 @@
 """
 
 import os
+import re
+import select
+import subprocess
 import cv2
+import numpy as np
 import threading
 import time
 
 import config
 from utils import log
 
+# Пул потоков OpenCV один на процесс: resize/cvtColor в потоках чтения камер не должны
+# запускать по CPU_THREADS воркеров каждый (N камер × CPU_THREADS потоков)
+cv2.setNumThreads(config.OPENCV_THREADS)
+
+try:
+    import av
+except ImportError:  # PyAV опционален: без него поток читается через OpenCV
+    av = None
+
+
+def _with_rtsp_timeout(options: str, avformat_major: int | None) -> str:
+    """
+    Добавляет к опциям таймаут RTSP_TIMEOUT_US под версию libavformat: stimeout для FFmpeg < 5
+    (libavformat < 59), timeout — для более новых. Версия неизвестна или таймаут уже задан — без изменений.
+    """
+    if config.RTSP_TIMEOUT_US <= 0 or avformat_major is None:
+        return options
+    items = [i for i in options.split("|") if i]
+    if any(i.startswith(("timeout;", "stimeout;")) for i in items):
+        return options
+    key = "timeout" if avformat_major >= 59 else "stimeout"
+    items.append(f"{key};{config.RTSP_TIMEOUT_US}")
+    return "|".join(items)
+
+
+def _opencv_avformat_major() -> int | None:
+    """Мажорная версия libavformat, с которой собран OpenCV (из getBuildInformation())."""
+    m = re.search(r"avformat:\s*YES \((\d+)\.", cv2.getBuildInformation())
+    return int(m.group(1)) if m else None
+
+
+# Опции FFmpeg для OpenCV и PyAV — у каждого своя сборка FFmpeg, поэтому таймаут подбирается отдельно
+_OPENCV_CAPTURE_OPTIONS = _with_rtsp_timeout(config.OPENCV_FFMPEG_CAPTURE_OPTIONS, _opencv_avformat_major())
+_PYAV_CAPTURE_OPTIONS = _with_rtsp_timeout(
+    config.OPENCV_FFMPEG_CAPTURE_OPTIONS, av.library_versions["libavformat"][0] if av is not None else None
+)
+
+# Low-latency опции для OpenCV/FFMPEG (чтобы не копить кадры “на минуты”).
+# Задаём один раз при импорте: переменная читается при создании VideoCapture,
+# а запись в os.environ из потока чтения (переоткрытие) и основного потока — гонка.
+if _OPENCV_CAPTURE_OPTIONS:
+    os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = _OPENCV_CAPTURE_OPTIONS
+
+_env_lock = threading.Lock()  # повторное открытие с увеличенным probesize меняет os.environ
+
+
+def _fallback_capture_options() -> str | None:
+    """Опции с увеличенным probesize, если в основных он меньше запасного значения."""
+    if not config.OPENCV_FFMPEG_FALLBACK_PROBESIZE:
+        return None
+    items = [i for i in _OPENCV_CAPTURE_OPTIONS.split("|") if i]
+    probe = [i for i in items if i.startswith("probesize;")]
+    if not probe:
+        return None
+    try:
+        if int(probe[0].split(";", 1)[1]) >= int(config.OPENCV_FFMPEG_FALLBACK_PROBESIZE):
+            return None
+    except ValueError:
+        return None
+    items = [i for i in items if not i.startswith("probesize;")]
+    items.append(f"probesize;{config.OPENCV_FFMPEG_FALLBACK_PROBESIZE}")
+    return "|".join(items)
+
+
+# Последний открытый общий ffmpeg (видео + аудио), из него читает AudioDetector
+_shared_capture = None
+# Сколько ждать первых байт видео от общего ffmpeg, прежде чем считать его запущенным (сек)
+_SHARED_FFMPEG_START_TIMEOUT = 10.0
+
+
+class FFmpegAVCapture:
+    """
+    Один процесс ffmpeg на RTSP-поток вместо двух подключений (OpenCV для видео + ffmpeg для аудио):
+    - видео декодируется в bgr24 и идёт в отдельный пайп;
+    - аудио (mono s16le) идёт в stdout и читается AudioDetector.
+    Повторяет нужную часть API cv2.VideoCapture (read/grab/retrieve/isOpened/release).
+    """
+
+    def __init__(self, src: str, width: int, height: int):
+        self.width = width
+        self.height = height
+        self._frame_bytes = width * height * 3
+        self._raw = bytearray(self._frame_bytes)
+
+        video_r, video_w = os.pipe()
+        cmd = [
+            "ffmpeg",
+            "-nostdin",
+            "-loglevel", "error",
+            "-rtsp_transport", "tcp",
+            "-fflags", "nobuffer",
+            "-flags", "low_delay",
+            "-i", src,
+            "-map", "0:v:0",
+            "-f", "rawvideo",
+            "-pix_fmt", "bgr24",
+            f"pipe:{video_w}",
+            "-map", "0:a:0?",
+            "-ac", "1",
+            "-ar", str(config.AUDIO_SAMPLE_RATE),
+            "-f", "s16le",
+            "pipe:1",
+        ]
+        try:
+            self.proc = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                pass_fds=(video_w,),
+            )
+        finally:
+            os.close(video_w)
+        self._video = os.fdopen(video_r, "rb", buffering=0)
+
+    def isOpened(self) -> bool:
+        return self.proc.poll() is None
+
+    def wait_started(self, timeout: float) -> bool:
+        """
+        Ждёт первые байты видео. ffmpeg может завершиться сразу после старта
+        (например, у камеры нет аудиодорожки и у аудиовыхода не остаётся потоков) —
+        тогда False, и open_camera() переключается на OpenCV.
+        """
+        readable, _, _ = select.select([self._video], [], [], timeout)
+        if not readable:
+            return self.isOpened()
+        # Пайп стал читаемым: либо пошли кадры, либо ffmpeg закрыл его, завершаясь
+        try:
+            self.proc.wait(timeout=0.2)
+        except subprocess.TimeoutExpired:
+            return True
+        return False
+
+    def grab(self) -> bool:
+        """Читает следующий кадр целиком во внутренний буфер."""
+        view = memoryview(self._raw)
+        got = 0
+        while got < self._frame_bytes:
+            n = self._video.readinto(view[got:])
+            if not n:
+                return False
+            got += n
+        return True
+
+    def retrieve(self, image=None):
+        raw = np.frombuffer(self._raw, dtype=np.uint8).reshape(self.height, self.width, 3)
+        # Как и в cv2.VideoCapture.retrieve(image): пишем в переданный буфер, если он подходит
+        if image is not None and image.shape == raw.shape:
+            np.copyto(image, raw)
+            return True, image
+        return True, raw.copy()
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def set(self, prop_id, value) -> bool:
+        return False
+
+    def release(self):
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=2.0)
+        except Exception:
+            pass
+        try:
+            self._video.close()
+        except Exception:
+            pass
+
+
+def _probe_video_size(src: str) -> tuple[int, int] | None:
+    """Узнаёт размер кадра потока через ffprobe (нужен для чтения rawvideo)."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-rtsp_transport", "tcp",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height",
+        "-of", "csv=p=0",
+        src,
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, timeout=15, check=True).stdout
+        width, height = out.decode().strip().split(",")[:2]
+        return int(width), int(height)
+    except Exception as e:
+        log(f"⚠️ ffprobe не смог определить размер кадра: {e}")
+        return None
+
+
+def _yolo_size(height: int, width: int) -> tuple[int, int] | None:
+    """(w, h) кадра для YOLO: длинная сторона = YOLO_IMGSZ, пропорции сохраняются. None — уменьшать не нужно."""
+    if not config.READER_YOLO_RESIZE:
+        return None
+    scale = config.YOLO_IMGSZ / max(height, width)
+    if scale >= 1.0:
+        return None
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def get_shared_audio_capture():
+    """Возвращает активный общий ffmpeg-захват (или None), чтобы аудио читалось из него."""
+    cap = _shared_capture
+    if cap is not None and cap.isOpened():
+        return cap
+    return None
+
 
 def open_camera(src: str, label: str = ""):
     """
@@ -18,20 +230,36 @@ def open_camera(src: str, label: str = ""):
     При RTSP принудительно добавляет TCP-транспорт.
     label — для лога (например номер камеры).
     """
+    global _shared_capture
     prefix = f" [{label}]" if label else ""
     log(f"🎥 Подключение к видеопотоку{prefix}: {src}")
 
+    if config.SHARED_FFMPEG and isinstance(src, str) and src.startswith("rtsp://"):
+        size = _probe_video_size(src)
+        if size is not None:
+            cap = FFmpegAVCapture(src, *size)
+            if cap.wait_started(_SHARED_FFMPEG_START_TIMEOUT):
+                _shared_capture = cap
+                log(f"✅ Видеопоток подключен{prefix} (общий ffmpeg для видео и аудио, {size[0]}x{size[1]})")
+                return cap
+            cap.release()
+        log(f"⚠️ Общий ffmpeg недоступен{prefix}, использую OpenCV")
+
     if isinstance(src, str) and src.startswith("rtsp://") and "rtsp_transport" not in src:
         sep = "&" if "?" in src else "?"
         src = src + f"{sep}rtsp_transport=tcp"
         log(f"   Использую RTSP over TCP{prefix}")
 
-    # Low-latency опции для OpenCV/FFMPEG (чтобы не копить кадры “на минуты”)
-    # Важно: переменная окружения должна быть задана ДО создания VideoCapture.
-    if config.OPENCV_FFMPEG_CAPTURE_OPTIONS:
-        os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = config.OPENCV_FFMPEG_CAPTURE_OPTIONS
-
     cap = cv2.VideoCapture(src, cv2.CAP_FFMPEG)
+    fallback = None if cap.isOpened() else _fallback_capture_options()
+    if fallback:
+        log(f"   Повтор с probesize={config.OPENCV_FFMPEG_FALLBACK_PROBESIZE}{prefix}")
+        with _env_lock:
+            os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = fallback
+            try:
+                cap = cv2.VideoCapture(src, cv2.CAP_FFMPEG)
+            finally:
+                os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = _OPENCV_CAPTURE_OPTIONS
     if not cap.isOpened():
         log(f"❌ Не удалось открыть видеопоток{prefix}.")
         return None
@@ -48,40 +276,147 @@ class LatestFrameStream:
     Это устраняет накопление буфера и “задержку на минуты” при медленной обработке.
     """
 
-    def __init__(self, cap: cv2.VideoCapture):
+    def __init__(self, cap: cv2.VideoCapture, src: str, label: str = "", start_ts: float | None = None):
         self._cap = cap
-        self._lock = threading.Lock()
+        self._src = src  # для переподключения после серии неудачных чтений
+        self._label = label
+        self._start_ts = start_ts or time.time()  # для лога задержки первого кадра
         self._stop = threading.Event()
+        # Замена self._cap при переоткрытии и release() в close() не должны разойтись
+        self._cap_lock = threading.Lock()
 
-        self._frame = None
-        self._frame_id = 0
-        self._last_ok_ts = 0.0
+        # Опубликованное состояние — один неизменяемый кортеж (frame, small, frame_id, last_ok_ts, slot).
+        # Пишет только поток чтения, замена ссылки атомарна под GIL — блокировка не нужна
+        self._snapshot = (None, None, 0, 0.0, -1)
+
+        # Три заранее выделенных кадра (публикуемый, отданный потребителю, записываемый):
+        # retrieve() декодирует прямо в свободный буфер, без нового массива на каждый кадр
+        self._buffers: list | None = None
+        self._held_slot = -1     # буфер, который сейчас у потребителя
+        self._writing_slot = -1  # буфер, в который сейчас пишет поток чтения
+        # Уменьшенные под YOLO копии кадров — по одной на слот, тоже без новых массивов
+        self._small_buffers: list = [None, None, None]
+
+        # grab() только читает пакет; retrieve() (конвертация в BGR + копия кадра)
+        # делаем, когда потребитель просит кадр, либо не реже TARGET_FPS
+        self._want = threading.Event()
+        self._min_interval = 1.0 / config.TARGET_FPS if config.TARGET_FPS > 0 else 0.0
+        self._last_decode_ts = 0.0
 
         self._thread = threading.Thread(target=self._run, daemon=True)
         self._thread.start()
 
+    def _fail(self, fail_count: int) -> int:
+        """Короткая растущая пауза после неудачного чтения; после серии неудач — переоткрытие потока."""
+        if fail_count < config.STREAM_RECONNECT_ATTEMPTS:
+            time.sleep(min(0.5, 0.01 * fail_count))
+            return fail_count
+
+        prefix = f" [{self._label}]" if self._label else ""
+        log(f"🔄 Поток{prefix} не отдаёт кадры ({fail_count} попыток), переоткрываю...")
+        try:
+            self._cap.release()
+        except Exception:
+            pass
+        if self._stop.wait(config.STREAM_RECONNECT_DELAY):
+            return 0
+        cap = open_camera(self._src, label=self._label)
+        if cap is None:
+            return 0
+        with self._cap_lock:
+            if not self._stop.is_set():
+                self._cap = cap
+                return 0
+        # close() пришёл во время переоткрытия: новый захват никому не нужен, иначе утечёт ffmpeg/RTSP
+        try:
+            cap.release()
+        except Exception:
+            pass
+        return 0
+
     def _run(self):
+        fail_count = 0
         while not self._stop.is_set():
-            ret, frame = self._cap.read()
+            if not self._cap.grab():
+                # Блокирующее чтение ограничено опцией timeout FFmpeg, здесь только счётчик неудач
+                fail_count = self._fail(fail_count + 1)
+                continue
+            fail_count = 0
+
             now = time.time()
+            frame, small, frame_id, _, pub_slot = self._snapshot
+            if not self._want.is_set() and (now - self._last_decode_ts) < self._min_interval:
+                # Кадр никому не нужен — пропускаем retrieve(), поток при этом жив
+                self._snapshot = (frame, small, frame_id, now, pub_slot)
+                continue
+
+            slot = self._claim_slot(pub_slot)
+            buf = self._buffers[slot] if self._buffers is not None else None
+            ret, frame = self._cap.retrieve(buf)
             if ret and frame is not None:
-                # Важно: OpenCV на каждом read() отдаёт новый массив,
-                # поэтому достаточно просто заменить ссылку — старый кадр не “портится”.
-                with self._lock:
-                    self._frame = frame
-                    self._frame_id += 1
-                    self._last_ok_ts = now
+                self._want.clear()
+                self._last_decode_ts = now
+                if self._buffers is None:
+                    self._buffers = [frame, np.empty_like(frame), np.empty_like(frame)]
+                elif frame is not buf:
+                    # Сменилось разрешение — OpenCV выделил новый массив, он и становится буфером
+                    self._buffers[slot] = frame
+                small = self._resize_for_yolo(frame, slot)
+                self._writing_slot = -1
+                self._snapshot = (frame, small, frame_id + 1, now, slot)
+                if frame_id == 0:
+                    prefix = f" [{self._label}]" if self._label else ""
+                    log(f"⏱️ Первый кадр{prefix} через {now - self._start_ts:.2f} сек после открытия")
             else:
-                # Небольшая пауза, чтобы не крутить 100% CPU при потере потока
-                time.sleep(0.05)
+                self._writing_slot = -1
+                fail_count = self._fail(fail_count + 1)
+
+    def _claim_slot(self, pub_slot: int) -> int:
+        """
+        Выбирает буфер для записи: не опубликованный и не занятый потребителем.
+        Сначала объявляем слот, потом перепроверяем потребителя; потребитель делает
+        зеркально (см. get_latest_pair) — так без блокировки они не захватят один буфер.
+        """
+        while True:
+            slot = next(i for i in range(3) if i != pub_slot and i != self._held_slot)
+            self._writing_slot = slot
+            if self._held_slot != slot:
+                return slot
+
+    def _resize_for_yolo(self, frame: np.ndarray, slot: int):
+        """Уменьшает кадр под YOLO в буфер слота (INTER_AREA). None — кадр уже не больше YOLO_IMGSZ."""
+        size = _yolo_size(*frame.shape[:2])
+        if size is None:
+            return None
+        dst = self._small_buffers[slot]
+        if dst is None or dst.shape[:2] != (size[1], size[0]):
+            dst = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        dst = cv2.resize(frame, size, dst=dst, interpolation=cv2.INTER_AREA)
+        self._small_buffers[slot] = dst
+        return dst
+
+    def get_latest_pair(self):
+        """
+        Возвращает (frame, small, frame_id, last_ok_ts): кадр и его копию, уменьшенную под YOLO
+        (small = None, если уменьшать не нужно). frame может быть None.
+        Кадры не перезаписываются потоком чтения до следующего вызова get_latest*().
+        """
+        self._want.set()  # следующий захваченный кадр будет декодирован
+        while True:
+            frame, small, frame_id, ts, slot = self._snapshot
+            self._held_slot = slot
+            # Поток чтения уже пишет в этот буфер (опубликован новый кадр) — берём свежий снимок
+            if slot < 0 or self._writing_slot != slot:
+                return frame, small, frame_id, ts
 
     def get_latest(self):
         """Возвращает (frame, frame_id, last_ok_ts). frame может быть None."""
-        with self._lock:
-            return self._frame, self._frame_id, self._last_ok_ts
+        frame, _, frame_id, ts = self.get_latest_pair()
+        return frame, frame_id, ts
 
     def close(self):
-        self._stop.set()
+        with self._cap_lock:
+            self._stop.set()
         try:
             self._thread.join(timeout=1.0)
         except Exception:
@@ -92,26 +427,213 @@ class LatestFrameStream:
             pass
 
 
+class YUVFrame:
+    """
+    Кадр в родном формате декодера (I420, 1.5 байта на пиксель вместо 3 у BGR).
+    В BGR переводится только запрошенная область. Поддерживает то, что main.py
+    использует у ndarray-кадра: shape, срез [y1:y2, x1:x2] и copy().
+    """
+
+    def __init__(self, i420: np.ndarray, height: int, width: int):
+        self._i420 = i420  # (H * 3 / 2, W): плоскости Y, U, V подряд
+        self.shape = (height, width, 3)
+
+    def _planes(self):
+        h, w = self.shape[:2]
+        q = h * w // 4
+        flat = self._i420.reshape(-1)
+        y = flat[:h * w].reshape(h, w)
+        u = flat[h * w:h * w + q].reshape(h // 2, w // 2)
+        v = flat[h * w + q:].reshape(h // 2, w // 2)
+        return y, u, v
+
+    def __getitem__(self, key):
+        """Срез img[y1:y2, x1:x2] -> BGR ndarray (конвертируется только эта область)."""
+        ys, xs = key[:2]
+        h, w = self.shape[:2]
+        y1, y2, _ = ys.indices(h)
+        x1, x2, _ = xs.indices(w)
+        if y2 <= y1 or x2 <= x1:
+            return np.empty((0, 0, 3), dtype=np.uint8)
+
+        # Границы по чётным пикселям: цветность хранится блоками 2x2
+        y1a, x1a = y1 & ~1, x1 & ~1
+        y2a, x2a = min(h, (y2 + 1) & ~1), min(w, (x2 + 1) & ~1)
+        y, u, v = self._planes()
+        roi = np.concatenate((
+            y[y1a:y2a, x1a:x2a].reshape(-1),
+            u[y1a // 2:y2a // 2, x1a // 2:x2a // 2].reshape(-1),
+            v[y1a // 2:y2a // 2, x1a // 2:x2a // 2].reshape(-1),
+        )).reshape((y2a - y1a) * 3 // 2, x2a - x1a)
+        bgr = cv2.cvtColor(roi, cv2.COLOR_YUV2BGR_I420)
+        return bgr[y1 - y1a:y2 - y1a, x1 - x1a:x2 - x1a]
+
+    def copy(self) -> np.ndarray:
+        """Полный кадр в BGR (для скриншотов)."""
+        return cv2.cvtColor(self._i420, cv2.COLOR_YUV2BGR_I420)
+
+
+def _pyav_options() -> dict:
+    """Опции FFmpeg для av.open() — те же, что и для OpenCV (формат "key;value|key;value")."""
+    options = {}
+    for item in _PYAV_CAPTURE_OPTIONS.split("|"):
+        key, _, value = item.partition(";")
+        if key.strip():
+            options[key.strip()] = value.strip()
+    return options
+
+
+# Форматы кадров, которые остаются в видеопамяти аппаратного декодера
+_HW_PIX_FMTS = {"cuda", "vaapi", "qsv", "d3d11", "dxva2_vld", "videotoolbox", "drm_prime", "vulkan"}
+
+
+class PyAVLatestFrameStream:
+    """
+    То же, что LatestFrameStream, но поток читается через PyAV:
+    демультиплексирование + декодирование на GPU/аппаратном декодере (PYAV_HWACCEL).
+    Хранится последний av.VideoFrame; в BGR (numpy) он конвертируется только по запросу потребителя.
+    """
+
+    def __init__(self, src: str):
+        self._src = src
+        self._stop = threading.Event()
+
+        # (последний av.VideoFrame, frame_id, last_ok_ts) — атомарная замена кортежа, без блокировки
+        self._snapshot = (None, 0, 0.0)
+        self._bgr = None  # BGR-кадр, сконвертированный для _bgr_id
+        self._small = None  # он же, уменьшенный под YOLO
+        self._bgr_id = 0
+
+        # Контекст аппаратного декодера создаётся один раз и переиспользуется при переподключениях
+        self._hwaccel = self._make_hwaccel()
+        self._container = self._open()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _make_hwaccel():
+        if not config.PYAV_HWACCEL:
+            return None
+        try:
+            from av.codec.hwaccel import HWAccel
+        except ImportError:
+            log("⚠️ PyAV собран без hwaccel, декодирование на CPU")
+            return None
+        return HWAccel(device_type=config.PYAV_HWACCEL, allow_software_fallback=True)
+
+    def _open(self):
+        container = av.open(self._src, options=_pyav_options(), timeout=10.0, hwaccel=self._hwaccel)
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        stream.codec_context.skip_frame = config.PYAV_SKIP_FRAME
+        return container
+
+    @staticmethod
+    def _frame_on_cpu(frame) -> bool:
+        """Кадр перенесён из видеопамяти и конвертируется на CPU (проверка маленьким reformat)."""
+        if frame.format.name in _HW_PIX_FMTS:
+            return False
+        try:
+            frame.to_ndarray(format="bgr24", width=16, height=16)
+        except Exception:
+            return False
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            checked = self._hwaccel is None
+            try:
+                for frame in self._container.decode(video=0):
+                    if self._stop.is_set():
+                        break
+                    if not checked:
+                        # Первый кадр аппаратного декодера: если он не переносится в память CPU —
+                        # переподключаемся с декодированием на CPU
+                        if not self._frame_on_cpu(frame):
+                            log(f"⚠️ Кадры {config.PYAV_HWACCEL} не переносятся в память CPU, декодирование на CPU")
+                            self._hwaccel = None
+                            break
+                        checked = True
+                    self._snapshot = (frame, self._snapshot[1] + 1, time.time())
+            except Exception as e:
+                log(f"⚠️ Ошибка чтения PyAV: {e}")
+            if self._stop.is_set():
+                break
+
+            # Поток оборвался — переподключаемся (с тем же контекстом декодера)
+            try:
+                self._container.close()
+            except Exception:
+                pass
+            time.sleep(config.STREAM_RECONNECT_DELAY)
+            try:
+                self._container = self._open()
+            except Exception as e:
+                log(f"⚠️ Не удалось переподключиться через PyAV: {e}")
+
+    def get_latest_pair(self):
+        """
+        Возвращает (frame, small, frame_id, last_ok_ts) — см. LatestFrameStream.get_latest_pair().
+        С READER_YUV_FRAMES frame — YUVFrame (в BGR переводятся только нужные области), small — всегда BGR.
+        """
+        frame, frame_id, ts = self._snapshot
+        if frame is None:
+            return None, None, frame_id, ts
+        if self._bgr_id != frame_id:
+            size = _yolo_size(frame.height, frame.width)
+            if config.READER_YUV_FRAMES and frame.width % 2 == 0 and frame.height % 2 == 0:
+                # Полный кадр остаётся в YUV; YOLO всегда получает отдельный BGR-кадр
+                self._bgr = YUVFrame(frame.to_ndarray(format="yuv420p"), frame.height, frame.width)
+                size = size or (frame.width, frame.height)
+            else:
+                self._bgr = frame.to_ndarray(format="bgr24")
+            # Масштабирование и перевод в BGR — один проход swscale
+            self._small = None if size is None else frame.to_ndarray(
+                format="bgr24", width=size[0], height=size[1], interpolation="AREA"
+            )
+            self._bgr_id = frame_id
+        return self._bgr, self._small, frame_id, ts
+
+    def get_latest(self):
+        """Возвращает (frame, frame_id, last_ok_ts). frame (BGR ndarray) может быть None."""
+        frame, _, frame_id, ts = self.get_latest_pair()
+        if isinstance(frame, YUVFrame):
+            frame = frame.copy()
+        return frame, frame_id, ts
+
+    def close(self):
+        self._stop.set()
+        try:
+            self._thread.join(timeout=1.0)
+        except Exception:
+            pass
+        try:
+            self._container.close()
+        except Exception:
+            pass
+
+
 def open_camera_stream(src: str | None = None, label: str = ""):
     """Открывает один видеопоток и возвращает LatestFrameStream или None. src=None — первый из config.STREAM_URLS."""
     if src is None:
         urls = config.STREAM_URLS
         src = urls[0] if urls else config.VIDEO_URL or "0"
+
+    # Общему ffmpeg нужен свой процесс (аудио для AudioDetector), поэтому PyAV только без SHARED_FFMPEG
+    if config.USE_PYAV_READER and av is not None and not config.SHARED_FFMPEG:
+        prefix = f" [{label}]" if label else ""
+        log(f"🎥 Подключение к видеопотоку через PyAV{prefix}: {src}")
+        try:
+            stream = PyAVLatestFrameStream(src)
+            hw = config.PYAV_HWACCEL or "CPU"
+            log(f"✅ Видеопоток подключен{prefix} (PyAV, декодер: {hw})")
+            return stream
+        except Exception as e:
+            log(f"⚠️ PyAV не смог открыть поток{prefix}: {e}, использую OpenCV")
+
+    start_ts = time.time()
     cap = open_camera(src, label=label)
     if cap is None:
         return None
-    return LatestFrameStream(cap)
-
-
-def open_camera_streams(urls: list[str]) -> list:
-    """
-    Открывает несколько видеопотоков. Возвращает список LatestFrameStream (или None для неудачных).
-    """
-    if not urls:
-        return []
-    streams = []
-    for i, url in enumerate(urls):
-        label = str(i) if len(urls) > 1 else ""
-        s = open_camera_stream(src=url, label=label)
-        streams.append(s)
-    return streams
+    return LatestFrameStream(cap, src, label=label, start_ts=start_ts)
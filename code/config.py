@@ -18,6 +18,10 @@ SCREENSHOTS_ENABLED = os.getenv("SCREENSHOTS_ENABLED", "true").lower() in ("true
 _screenshot_objects_str = os.getenv("SCREENSHOT_OBJECTS", "person,dog")
 SCREENSHOT_OBJECTS = set(c.strip().lower() for c in _screenshot_objects_str.split(",") if c.strip())
 
+# Кодирование скриншотов в JPEG: turbojpeg (libjpeg-turbo, SIMD) или opencv
+SCREENSHOT_ENCODER = os.getenv("SCREENSHOT_ENCODER", "turbojpeg").lower()
+SCREENSHOT_JPEG_QUALITY = int(os.getenv("SCREENSHOT_JPEG_QUALITY", "95"))
+
 # Пути к файлам кэша (старый формат)
 EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "embeddings.npy")
 NAMES_PATH = os.path.join(CACHE_DIR, "names.json")
@@ -49,17 +53,49 @@ STREAM_RECONNECT_ATTEMPTS = int(os.getenv("STREAM_RECONNECT_ATTEMPTS", "50"))  #
 STREAM_RECONNECT_DELAY = float(os.getenv("STREAM_RECONNECT_DELAY", "2.0"))     # пауза перед переподключением (сек)
 STREAM_STALE_SEC = float(os.getenv("STREAM_STALE_SEC", "2.0"))                 # если нет новых кадров дольше N сек — считаем поток “застрявшим”
 
+# Минимальная частота выдачи кадров из потока чтения, даже если их никто не запрашивал
+# (остальные кадры только захватываются grab() без retrieve()). 0 = только по запросу
+TARGET_FPS = float(os.getenv("TARGET_FPS", "5"))
+
+# Один процесс ffmpeg на RTSP для видео и аудио (вместо двух подключений к камере).
+# Аудио при этом читает AudioDetector, поэтому без YAMNET_CLASSES флаг не действует (см. ниже).
+SHARED_FFMPEG = os.getenv("SHARED_FFMPEG", "false").lower() in ("true", "1", "yes")
+
+# Чтение потока через PyAV (демультиплексирование + аппаратное декодирование) вместо OpenCV
+USE_PYAV_READER = os.getenv("USE_PYAV_READER", "false").lower() in ("true", "1", "yes")
+PYAV_HWACCEL = os.getenv("PYAV_HWACCEL", "cuda")  # cuda / vaapi / qsv; пусто = декодирование на CPU
+# PyAV: отдавать кадр в родном YUV420p, в BGR переводить только нужные области (кропы лиц, скриншоты)
+READER_YUV_FRAMES = os.getenv("READER_YUV_FRAMES", "true").lower() in ("true", "1", "yes")
+# PyAV: какие кадры декодер пропускает (skip_frame): DEFAULT — никакие, NONREF — неопорные,
+# NONKEY — все, кроме ключевых (когда YOLO всё равно не успевает за FPS камеры; кадр обновляется раз в GOP)
+PYAV_SKIP_FRAME = os.getenv("PYAV_SKIP_FRAME", "DEFAULT").upper()
+
 # OpenCV/FFMPEG low-latency опции (применяются при открытии VideoCapture)
-# Формат: "key;value|key;value|..."
+# Формат: "key;value|key;value|..." (те же опции получает PyAV)
+# probesize/analyzeduration — не анализировать поток секундами перед первым кадром
 OPENCV_FFMPEG_CAPTURE_OPTIONS = os.getenv(
     "OPENCV_FFMPEG_CAPTURE_OPTIONS",
-    "rtsp_transport;tcp|fflags;nobuffer|flags;low_delay|max_delay;0",
+    "rtsp_transport;tcp|fflags;nobuffer|flags;low_delay|max_delay;0|probesize;32|analyzeduration;0",
 )
+# Таймаут (мкс) блокирующего чтения с «мёртвого» RTSP (0 — без таймаута). Имя опции зависит от FFmpeg
+# в OpenCV/PyAV: stimeout до FFmpeg 5 (там timeout — ожидание входящего соединения, режим listen),
+# timeout с FFmpeg 5 — camera.py выбирает его по версии libavformat
+RTSP_TIMEOUT_US = int(os.getenv("RTSP_TIMEOUT_US", "5000000"))
+# Если с минимальным probesize поток не открылся (H.264 без SPS/PPS в первых пакетах) — повтор с этим
+OPENCV_FFMPEG_FALLBACK_PROBESIZE = os.getenv("OPENCV_FFMPEG_FALLBACK_PROBESIZE", "500000")
 
 # YOLO
 YOLO_MODEL = os.getenv("YOLO_MODEL", "yolo11n.pt")   # YOLOv11
 YOLO_FORCE_GPU = True
 YOLO_IMGSZ = int(os.getenv("YOLO_IMGSZ", "640"))     # размер изображения для обработки (меньше = быстрее)
+# Уменьшать кадр до YOLO_IMGSZ (по длинной стороне) один раз в потоке чтения, а не в каждом потребителе
+READER_YOLO_RESIZE = os.getenv("READER_YOLO_RESIZE", "true").lower() in ("true", "1", "yes")
+# Экспорт YOLO для инференса без PyTorch: "engine" (TensorRT), "onnx", "openvino"; пусто — PyTorch (.pt)
+YOLO_EXPORT_FORMAT = os.getenv("YOLO_EXPORT_FORMAT", "").strip().lower()
+# Запускать YOLO и распознавание лиц раз в N кадров (1 — на каждом кадре)
+DETECT_EVERY_N = max(1, int(os.getenv("DETECT_EVERY_N", "1")))
+# Раз в N секунд писать в лог FPS и среднее время стадий на кадр (YOLO, лица, весь кадр). 0 — не писать
+PERF_LOG_INTERVAL = float(os.getenv("PERF_LOG_INTERVAL", "0"))
 YOLO_FP16 = os.getenv("YOLO_FP16", "true").lower() in ("true", "1", "yes")  # FP16 инференс (GPU)
 YOLO_CONFIDENCE_THRESHOLD = float(os.getenv("YOLO_CONFIDENCE_THRESHOLD", "0.25"))  # мин. confidence для объектов
 YOLO_PERSON_CONFIDENCE = float(os.getenv("YOLO_PERSON_CONFIDENCE", "0.55"))        # порог для person (выше = меньше ложных срабатываний типа одежды)
@@ -70,10 +106,22 @@ YOLO_IGNORE_CLASSES = set(c.strip() for c in _ignore_str.split(",") if c.strip()
 
 # InsightFace
 INSIGHTFACE_MODEL = "antelopev2"  # строго для Immich
+# InsightFace через TensorRT Execution Provider (FP16, движки кэшируются в FACE_TRT_CACHE_DIR).
+# Нужны библиотеки TensorRT в образе, иначе ONNX Runtime остаётся на CUDA
+FACE_TRT = os.getenv("FACE_TRT", "false").lower() in ("true", "1", "yes")
+FACE_TRT_CACHE_DIR = os.path.join(CACHE_DIR, "trt")
+# Профиль движка распознавания: батч лиц от 1 до FACE_TRT_MAX_BATCH (больше — несколькими вызовами)
+FACE_TRT_MAX_BATCH = max(1, int(os.getenv("FACE_TRT_MAX_BATCH", "32")))
 
 # Пороги распознавания лиц
 FACE_SIM_THRESHOLD = float(os.getenv("FACE_SIM_THRESHOLD", "0.55"))  # базовый порог
 MIN_SIM_DIFF = float(os.getenv("MIN_SIM_DIFF", "0.08"))  # мин. разница лучшего и второго
+# Хранить базу лиц в int8 и сравнивать целочисленным скалярным произведением (погрешность сходства ~1e-3).
+# Только с Numba: без неё флаг не действует
+FACE_MATCH_INT8 = os.getenv("FACE_MATCH_INT8", "false").lower() in ("true", "1", "yes")
+# HNSW-индекс (hnswlib) вместо полного прохода, если векторов в базе не меньше порога (float32-база)
+FACE_ANN_MIN_EMBEDDINGS = int(os.getenv("FACE_ANN_MIN_EMBEDDINGS", "1000"))
+FACE_ANN_K = int(os.getenv("FACE_ANN_K", "64"))  # запас кандидатов из индекса сверх макс. векторов одного человека
 
 # Анти-дребезг для важных объектов (person, dog, cat)
 MAX_MISSING = int(os.getenv("MAX_MISSING", "30"))   # сколько кадров объект может отсутствовать
@@ -85,7 +133,7 @@ MIN_STABLE_OTHER = int(os.getenv("MIN_STABLE_OTHER", "25"))      # дольше
 
 # Важные объекты (используют основные параметры анти-дребезга)
 _important_str = os.getenv("IMPORTANT_OBJECTS", "person,dog,cat")
-IMPORTANT_OBJECTS = set(c.strip() for c in _important_str.split(",") if c.strip())
+IMPORTANT_OBJECTS = frozenset(c.strip() for c in _important_str.split(",") if c.strip())
 
 # Улучшения распознавания лиц
 FACE_PADDING_RATIO = float(os.getenv("FACE_PADDING_RATIO", "0.2"))        # 20% расширения bounding box
@@ -93,20 +141,66 @@ MAX_FACES_PER_CROP = int(os.getenv("MAX_FACES_PER_CROP", "10"))          # ма
 FACE_DET_SIZE = int(os.getenv("FACE_DET_SIZE", "1280"))                   # размер детекции InsightFace
 MIN_FACE_SIZE = int(os.getenv("MIN_FACE_SIZE", "64"))                     # мин. размер лица (px)
 FACE_TRACKING_FRAMES = int(os.getenv("FACE_TRACKING_FRAMES", "5"))        # кадров для трекинга
+FACE_REFRESH_FRAMES = int(os.getenv("FACE_REFRESH_FRAMES", "30"))         # переопознавать стабильных людей раз в N кадров (0 — каждый кадр)
+FACE_SKIP_IOU = float(os.getenv("FACE_SKIP_IOU", "0.5"))                  # мин. IoU боксов person с прошлым кадром, чтобы не переопознавать
 
 # Настройки кэша лиц
 FACE_CACHE_VALIDITY_FRAMES = 30  # кэш действителен N кадров
+MAX_FACE_CACHE = 256             # максимум записей в кэше лиц (LRU)
+FACE_CACHE_LSH_BITS = 16         # бит ключа кэша (случайные проекции): больше — строже совпадение
 
 # Классы YAMNet для детекции (из .env, через запятую)
 # Полный список: https://github.com/tensorflow/models/blob/master/research/audioset/yamnet/yamnet_class_map.csv
 _yamnet_str = os.getenv("YAMNET_CLASSES", "Speech,Dog,Bark")
 YAMNET_CLASSES = [s.strip().lower() for s in _yamnet_str.split(",") if s.strip()]
+# Без отслеживаемых звуков аудиодетектор не создаётся и пайп аудио общего ffmpeg никто не читает:
+# ffmpeg упрётся в полный пайп и остановит видео. Поэтому общий ffmpeg — только вместе с YAMNET_CLASSES
+SHARED_FFMPEG = SHARED_FFMPEG and bool(YAMNET_CLASSES)
+
+# Сколько окон YAMNet (0.96 с, перекрытие 50%) обрабатывать за один вызов модели
+YAMNET_BATCH = max(1, int(os.getenv("YAMNET_BATCH", "1")))
+# Как часто вызывать YAMNet (мс нового аудио между вызовами). 128 — как раньше, на каждый кусок PCM из ffmpeg:
+# минимальная задержка, но модель работает ~8 раз в секунду. Больше (например 480 — шаг окна YAMNet
+# × YAMNET_BATCH) — меньше CPU ценой задержки обнаружения до этого интервала
+YAMNET_INFER_HOP_MS = max(1.0, float(os.getenv("YAMNET_INFER_HOP_MS", "128")))
+# Как сводить оценки окон одного вызова при YAMNET_BATCH > 1: mean — как для одного окна,
+# max — короткий звук не "размывается" соседними окнами, но и случайный всплеск в одном окне даёт срабатывание
+YAMNET_SCORE_AGG = os.getenv("YAMNET_SCORE_AGG", "mean").lower()
+
+# Квантованная TFLite-модель YAMNet (вход 15600 сэмплов). Если файла нет — SavedModel через TF Hub
+YAMNET_USE_TFLITE = os.getenv("YAMNET_USE_TFLITE", "true").lower() in ("true", "1", "yes")
+YAMNET_TFLITE_PATH = os.getenv("YAMNET_TFLITE_PATH", os.path.join(MODEL_DIR, "yamnet.tflite"))
+# FP16-конвертация SavedModel (создаётся автоматически при первом запуске без TFLite-модели)
+YAMNET_FP16_PATH = os.getenv("YAMNET_FP16_PATH", os.path.join(MODEL_DIR, "yamnet_fp16.tflite"))
+YAMNET_THREADS = int(os.getenv("YAMNET_THREADS", "2"))  # потоков для инференса YAMNet
+
+# Кэш TF Hub и локальная копия SavedModel YAMNet (быстрый старт без сети)
+TFHUB_CACHE_DIR = os.getenv("TFHUB_CACHE_DIR", os.path.join(MODEL_DIR, "tfhub"))
+YAMNET_LOCAL_DIR = os.getenv("YAMNET_LOCAL_DIR", os.path.join(MODEL_DIR, "yamnet_saved_model"))
+
+# Гейт тишины: если RMS окна (в долях полной шкалы) ниже порога — YAMNet не вызывается. 0 = выключено
+SILENCE_GATE = float(os.getenv("SILENCE_GATE", "0.002"))
+
+# Сколько секунд переиспользовать результат YAMNet для почти одинаковых окон (0 = без кэша, по умолчанию).
+# Окна "одинаковые", если энергия ни одной из 16 лог-полос не изменилась больше чем на YAMNET_CACHE_DB дБ
+YAMNET_CACHE_TTL = float(os.getenv("YAMNET_CACHE_TTL", "0"))
+YAMNET_CACHE_DB = float(os.getenv("YAMNET_CACHE_DB", "3.0"))
+
+# YAMNet в отдельном процессе (audio_worker.py): инференс не делит GIL с видеопотоком и YOLO.
+# С SHARED_FFMPEG аудио читается из пайпа видеопотока, поэтому детектор остаётся в потоках основного процесса.
+AUDIO_PROCESS = os.getenv("AUDIO_PROCESS", "true").lower() in ("true", "1", "yes")
+# Ядра CPU для процесса аудиодетектора (через запятую, пусто = без привязки)
+_audio_cpus_str = os.getenv("AUDIO_CPU_AFFINITY", "")
+AUDIO_CPU_AFFINITY = [int(c) for c in _audio_cpus_str.split(",") if c.strip()]
 
 # Аудио с камеры приведём к этому sample rate
 AUDIO_SAMPLE_RATE = 16000
 
 # Количество CPU потоков для обработки
 CPU_THREADS = int(os.getenv("CPU_THREADS", "4"))  # количество ядер CPU для использования
+# Пул потоков OpenCV (общий на процесс). По умолчанию 1: потоки чтения камер и main не должны
+# раздувать каждый вызов cv2 на CPU_THREADS воркеров — CPU_THREADS достаются torch/ONNX/Numba (OMP_NUM_THREADS)
+OPENCV_THREADS = int(os.getenv("OPENCV_THREADS", "1"))
 
 # ============================================
 # MQTT (интеграция с Home Assistant)
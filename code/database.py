@@ -3,14 +3,77 @@
 Работа с PostgreSQL Immich: вытаскивание векторных представлений и confidence.
 """
 
+import atexit
+import io
 import json
+import struct
+import threading
 import time
+from contextlib import contextmanager
 
 import numpy as np
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 
 import config
-from utils import log, _l2_normalize
+from utils import log
+
+
+# Общая часть запроса: векторы лиц людей с именами
+_EMB_QUERY_FROM = """
+    FROM person p
+    JOIN asset_face af ON af."personId" = p.id
+    JOIN face_search fs ON fs."faceId" = af.id
+    WHERE p.name IS NOT NULL AND TRIM(p.name) <> '' AND fs.embedding IS NOT NULL
+    ORDER BY p.id
+"""
+
+_PG_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+# Пулы соединений по имени базы: TLS/авторизация один раз, дальше соединения переиспользуются
+_pools: dict[str, ThreadedConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(dbname: str) -> ThreadedConnectionPool:
+    """Пул соединений к базе dbname (создаётся при первом обращении)."""
+    with _pools_lock:
+        pool = _pools.get(dbname)
+        if pool is None:
+            cfg = dict(config.DB_CONFIG, dbname=dbname)
+            pool = ThreadedConnectionPool(1, 4, **cfg, connect_timeout=10)
+            _pools[dbname] = pool
+        return pool
+
+
+@contextmanager
+def pooled_connection(dbname: str | None = None):
+    """
+    Соединение из пула (по умолчанию — база Immich из DB_CONFIG).
+    При выходе без ошибки — commit, при ошибке — rollback; соединение возвращается в пул,
+    оборванное — закрывается.
+    """
+    pool = _get_pool(dbname or config.DB_CONFIG["dbname"])
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+@atexit.register
+def _close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
 
 
 def fetch_embeddings_from_db():
@@ -18,12 +81,13 @@ def fetch_embeddings_from_db():
     Грузит векторные представления из Immich:
     - p.id, p.name, fs.embedding, af.confidence (если доступно)
     - группирует по personId
-    - нормализует каждое векторное представление
+    - нормализует все векторные представления одним проходом
     Возвращает:
-        all_embs_list: List[List[np.ndarray]]
+        embs: np.ndarray (N, D) float32, L2-нормализованные
+        offsets: np.ndarray (P + 1,) — векторы человека i: embs[offsets[i]:offsets[i + 1]]
         names: List[str]
         ids: List[int]
-        all_confidences_list: List[List[float]]
+        confidences: np.ndarray (N,) float32
     """
     start_time = time.time()
     log("📡 Подключаюсь к базе Immich...")
@@ -34,7 +98,8 @@ def fetch_embeddings_from_db():
 
     try:
         conn_start = time.time()
-        conn = psycopg2.connect(**config.DB_CONFIG, connect_timeout=10)
+        pool = _get_pool(config.DB_CONFIG["dbname"])
+        conn = pool.getconn()
         conn_time = time.time() - conn_start
         log(f"✅ Подключение к базе установлено (заняло {conn_time:.2f} сек)")
     except psycopg2.OperationalError as e:
@@ -44,83 +109,157 @@ def fetch_embeddings_from_db():
         log(f"❌ Неожиданная ошибка при подключении: {e}")
         raise
 
-    cur = conn.cursor()
     log("📊 Выполняю запрос к базе данных...")
-
     query_start = time.time()
-    cur.execute(
-        """
-        SELECT p.id, p.name, fs.embedding
-        FROM person p
-        JOIN asset_face af ON af."personId" = p.id
-        JOIN face_search fs ON fs."faceId" = af.id
-        WHERE p.name IS NOT NULL AND TRIM(p.name) <> ''
-        ORDER BY p.id;
-        """
-    )
+    try:
+        # База Immich только читается. READ ONLY — на транзакцию, а не set_session():
+        # настройка сессии осталась бы на соединении в пуле
+        try:
+            _begin_read_only(conn)
+            pids, pnames, embs = _fetch_rows_binary(conn)
+        except Exception as e:
+            # Например, тип embedding не приводится к real[] — читаем по-старому, текстом
+            log(f"⚠️ Бинарный COPY не удался ({e}), читаю векторы текстом...")
+            conn.rollback()
+            _begin_read_only(conn)
+            pids, pnames, embs = _fetch_rows_text(conn)
+        conn.rollback()  # закрываем читающую транзакцию перед возвратом в пул
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
     query_time = time.time() - query_start
-    log(f"✅ Запрос выполнен успешно (заняло {query_time:.2f} сек)")
-
-    log("📥 Получаю результаты запроса...")
-    fetch_start = time.time()
-    rows = cur.fetchall()
-    fetch_time = time.time() - fetch_start
-    log(f"✅ Получено {len(rows)} строк из базы данных (заняло {fetch_time:.2f} сек)")
-
-    cur.close()
-    conn.close()
-    log("✅ Соединение с базой закрыто")
+    log(f"✅ Получено {len(pids)} строк из базы данных (заняло {query_time:.2f} сек)")
+    log("✅ Соединение с базой возвращено в пул")
 
     log("🔄 Обрабатываю результаты...")
     by_id = {}
-    processed = 0
-    total = len(rows)
-    log_interval = max(1, total // 10) if total > 0 else 1
-
-    for row in rows:
-        processed += 1
-        if processed % log_interval == 0 or processed == total:
-            pct = processed * 100 // total if total > 0 else 0
-            log(f"   Обработано {processed}/{total} строк ({pct}%)")
-
-        pid, pname, emb = row
-
-        if not pname or emb is None:
-            continue
-
-        if isinstance(emb, str):
-            try:
-                emb = json.loads(emb)
-            except Exception:
-                emb = [float(x) for x in emb.strip("[] ").split(",") if x.strip()]
-
-        emb = np.asarray(emb, dtype=np.float32)
-        if emb.ndim != 1:
-            continue
-
-        rec = by_id.setdefault(pid, {"name": pname.strip(), "embs": []})
-        rec["embs"].append(emb)
+    for row, (pid, pname) in enumerate(zip(pids, pnames)):
+        rec = by_id.setdefault(pid, {"name": pname.strip(), "rows": []})
+        rec["rows"].append(row)
 
     log(f"✅ Обработка завершена. Найдено {len(by_id)} уникальных персон")
 
-    log("📦 Формирую финальные списки векторных представлений...")
-    ids, names, all_embs_list = [], [], []
-    all_confidences_list = []
+    log("📦 Формирую общую матрицу векторных представлений...")
+    ids, names, counts, order = [], [], [], []
 
     for pid, rec in by_id.items():
         ids.append(pid)
         names.append(rec["name"])
+        counts.append(len(rec["rows"]))
+        order.extend(rec["rows"])
+
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
 
-        normalized_embs = [_l2_normalize(emb) for emb in rec["embs"]]
-        all_embs_list.append(normalized_embs)
-        # Confidence не поддерживается в Immich <= v2.4.1, используем 1.0
-        all_confidences_list.append([1.0] * len(normalized_embs))
+    if order:
+        # Одна матрица (N, D), сгруппированная по людям, и одна нормализация вместо N отдельных вызовов
+        embs = np.ascontiguousarray(embs[order], dtype=np.float32)
+        norms = np.linalg.norm(embs, axis=1, keepdims=True)
+        embs /= np.maximum(norms, 1e-9)
+    else:
+        embs = np.zeros((0, 0), dtype=np.float32)
+    # Confidence не поддерживается в Immich <= v2.4.1, используем 1.0
+    confidences = np.ones(len(embs), dtype=np.float32)
 
     log(f"✅ Загружено {len(ids)} лиц из Immich:")
-    for pid, name, embs_list in zip(ids, names, all_embs_list):
-        log(f"   - {pid:<4} | {name} ({len(embs_list)} векторов)")
+    for pid, name, count in zip(ids, names, counts):
+        log(f"   - {pid:<4} | {name} ({count} векторов)")
 
     total_time = time.time() - start_time
     log(f"✅ Загрузка из базы завершена за {total_time:.2f} сек")
 
-    return all_embs_list, names, ids, all_confidences_list
+    return embs, offsets, names, ids, confidences
+
+
+def _begin_read_only(conn):
+    """Начинает транзакцию только на чтение (первая команда транзакции)."""
+    with conn.cursor() as cur:
+        cur.execute("SET TRANSACTION READ ONLY")
+
+
+def _fetch_rows_binary(conn):
+    """
+    COPY ... TO STDOUT (FORMAT binary): векторы приходят как real[] в двоичном виде
+    и собираются в матрицу (N, D) одним векторизованным чтением, без json.loads по строкам.
+    Возвращает (pids, pnames, embs).
+    """
+    buf = io.BytesIO()
+    with conn.cursor() as cur:
+        cur.copy_expert(
+            f"COPY (SELECT p.id::text, p.name, fs.embedding::real[] {_EMB_QUERY_FROM}) "
+            "TO STDOUT WITH (FORMAT binary)",
+            buf,
+        )
+    data = buf.getbuffer()
+    if bytes(data[:11]) != _PG_COPY_SIGNATURE:
+        raise ValueError("неожиданный формат COPY")
+
+    # Заголовок: сигнатура (11) + флаги (4) + длина расширения (4) + расширение
+    pos = 19 + struct.unpack_from(">I", data, 15)[0]
+    pids, pnames, emb_starts = [], [], []
+    dim = -1
+    while True:
+        (nfields,) = struct.unpack_from(">h", data, pos)
+        pos += 2
+        if nfields == -1:  # конец данных
+            break
+        fields = []
+        for _ in range(nfields):
+            (length,) = struct.unpack_from(">i", data, pos)
+            pos += 4
+            fields.append((pos, length))
+            pos += max(length, 0)
+
+        (id_pos, id_len), (name_pos, name_len), (arr_pos, arr_len) = fields
+        if name_len <= 0 or arr_len <= 0:
+            continue
+        # Массив: ndim, флаги, oid элемента, размер, нижняя граница (по 4 байта), далее (длина, float4)
+        ndim, _, _, n = struct.unpack_from(">iiii", data, arr_pos)
+        if ndim != 1 or (dim != -1 and n != dim):
+            raise ValueError("векторы разной размерности")
+        dim = n
+        pids.append(bytes(data[id_pos:id_pos + id_len]).decode("utf-8"))
+        pnames.append(bytes(data[name_pos:name_pos + name_len]).decode("utf-8"))
+        emb_starts.append(arr_pos + 20 + 4)  # первый float4 после его 4-байтной длины
+
+    if not emb_starts:
+        return pids, pnames, np.zeros((0, 0), dtype=np.float32)
+
+    # float4 в массиве идут с шагом 8 байт (длина + значение): строгий вид на буфер без копии,
+    # конвертация big-endian -> float32 сразу в заранее выделенную матрицу
+    embs = np.empty((len(emb_starts), dim), dtype=np.float32)
+    for row, start in enumerate(emb_starts):
+        embs[row] = np.ndarray((dim,), dtype=">f4", buffer=data, offset=start, strides=(8,))
+    return pids, pnames, embs
+
+
+def _fetch_rows_text(conn):
+    """
+    Обычный SELECT: векторы приходят текстом и разбираются построчно. Возвращает (pids, pnames, embs).
+    Серверный курсор отдаёт строки пачками по itersize — разбор идёт параллельно с передачей,
+    и все строки не держатся в памяти кортежами.
+    """
+    pids, pnames, flat = [], [], []
+    with conn.cursor(name="emb_cursor") as cur:
+        cur.itersize = 1000
+        # p.id::text — тот же тип id, что и в бинарном пути
+        cur.execute(f"SELECT p.id::text, p.name, fs.embedding {_EMB_QUERY_FROM};")
+        for pid, pname, emb in cur:
+            if not pname or emb is None:
+                continue
+
+            if isinstance(emb, str):
+                try:
+                    emb = json.loads(emb)
+                except Exception:
+                    emb = [float(x) for x in emb.strip("[] ").split(",") if x.strip()]
+
+            emb = np.asarray(emb, dtype=np.float32)
+            if emb.ndim != 1:
+                continue
+
+            pids.append(pid)
+            pnames.append(pname)
+            flat.append(emb)
+
+    embs = np.vstack(flat) if flat else np.zeros((0, 0), dtype=np.float32)
+    return pids, pnames, embs
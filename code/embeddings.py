@@ -1,79 +1,74 @@
 # embeddings.py
 """
 Загрузка и кэширование векторных представлений лиц из Immich.
-Хранение по отдельным файлам для каждого человека.
+Кэш: одна матрица float32 (embs.npy, читается через mmap) + метаданные в gallery.json.
 """
 
 import json
 import os
-import pickle
 
 import numpy as np
 
 import config
-from utils import ensure_dirs, _l2_normalize, log
+from utils import ensure_dirs, log
 from database import fetch_embeddings_from_db
 
+try:
+    import orjson
+except ImportError:  # orjson опционален: без него метаданные читает/пишет стандартный json
+    orjson = None
+
 
 # Папка для хранения данных по людям
 FACES_CACHE_DIR = os.path.join(config.CACHE_DIR, "faces")
+EMBS_PATH = os.path.join(FACES_CACHE_DIR, "embs.npy")
+META_PATH = os.path.join(FACES_CACHE_DIR, "gallery.json")
 
 
 def load_or_refresh_cache(force_refresh: bool = False):
     """
     Загружает векторные представления из кэша, либо при необходимости — из базы Immich.
-    Использует отдельные файлы для каждого человека.
+    Возвращает (embs, offsets, names, ids, confidences) — см. fetch_embeddings_from_db().
     """
     ensure_dirs()
     os.makedirs(FACES_CACHE_DIR, exist_ok=True)
 
-    index_path = os.path.join(FACES_CACHE_DIR, "index.json")
-    cache_exists = os.path.exists(index_path)
+    cache_exists = os.path.exists(EMBS_PATH) and os.path.exists(META_PATH)
 
     if cache_exists and not force_refresh:
         return _load_from_files()
 
     # Загружаем из БД
     log("📦 Загрузка базы лиц из Immich (из БД)...")
-    all_embs_list, names, ids, all_confidences_list = fetch_embeddings_from_db()
+    embs, offsets, names, ids, confidences = fetch_embeddings_from_db()
     
     # Сохраняем в новый формат
-    _save_to_files(all_embs_list, names, ids, all_confidences_list)
+    _save_to_files(embs, offsets, names, ids, confidences)
 
-    log(f"✅ База лиц загружена ({len(all_embs_list)} человек)")
-    return all_embs_list, names, ids, all_confidences_list
+    log(f"✅ База лиц загружена ({len(ids)} человек)")
+    return embs, offsets, names, ids, confidences
 
 
 def _load_from_files():
-    """Загружает данные из отдельных файлов для каждого человека."""
+    """Загружает матрицу векторных представлений (mmap) и метаданные по людям."""
     log("📦 Загрузка векторных представлений лиц из Immich...")
     
-    index_path = os.path.join(FACES_CACHE_DIR, "index.json")
-    with open(index_path, "r", encoding="utf-8") as f:
-        index = json.load(f)
-    
-    all_embs_list = []
-    names = []
-    ids = []
-    all_confidences_list = []
-    loaded_names = []  # Для вывода в лог
-    
-    for entry in index:
-        person_id = entry["id"]
-        name = entry["name"]
-        
-        person_file = os.path.join(FACES_CACHE_DIR, f"{person_id}.pkl")
-        
-        with open(person_file, "rb") as f:
-            person_data = pickle.load(f)
-        
-        all_embs_list.append(person_data["embeddings"])
-        names.append(name)
-        ids.append(person_id)
-        all_confidences_list.append(person_data["confidences"])
-        loaded_names.append(f"{name}({len(person_data['embeddings'])})")
+    with open(META_PATH, "rb") as f:
+        raw = f.read()
+    meta = orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+    # Страницы файла подгружаются ОС по мере обращения, без разбора и копирования при старте
+    embs = np.load(EMBS_PATH, mmap_mode="r")
+    offsets = np.asarray(meta["offsets"], dtype=np.int64)
+    confidences = np.asarray(meta["confidences"], dtype=np.float32)
+    names = meta["names"]
+    ids = meta["ids"]
+
+    loaded_names = [
+        f"{name}({offsets[i + 1] - offsets[i]})" for i, name in enumerate(names)
+    ]
     
-    log(f"✅ База лиц загружена ({len(all_embs_list)} человек)")
+    log(f"✅ База лиц загружена ({len(ids)} человек)")
     
     # Выводим имена по 5 на строку
     names_per_line = 5
@@ -81,30 +76,38 @@ def _load_from_files():
         chunk = loaded_names[i:i + names_per_line]
         log(f"   👥 {', '.join(chunk)}")
     
-    return all_embs_list, names, ids, all_confidences_list
+    return embs, offsets, names, ids, confidences
 
 
-def _save_to_files(all_embs_list: list, names: list, ids: list, all_confidences_list: list):
-    """Сохраняет данные в отдельные файлы для каждого человека."""
+def _save_to_files(embs: np.ndarray, offsets: np.ndarray, names: list, ids: list, confidences: np.ndarray):
+    """Сохраняет матрицу (уже нормализованную) в embs.npy и метаданные в gallery.json."""
     os.makedirs(FACES_CACHE_DIR, exist_ok=True)
-    
-    # Создаём индекс
-    index = []
-    for person_id, name in zip(ids, names):
-        index.append({"id": person_id, "name": name})
-    
-    index_path = os.path.join(FACES_CACHE_DIR, "index.json")
-    with open(index_path, "w", encoding="utf-8") as f:
-        json.dump(index, f, ensure_ascii=False, indent=2)
-    
-    # Сохраняем данные каждого человека
-    for person_id, embs, confs in zip(ids, all_embs_list, all_confidences_list):
-        person_data = {
-            "embeddings": embs,
-            "confidences": confs,
-        }
-        person_file = os.path.join(FACES_CACHE_DIR, f"{person_id}.pkl")
-        with open(person_file, "wb") as f:
-            pickle.dump(person_data, f, protocol=pickle.HIGHEST_PROTOCOL)
 
+    # Пишем во временные файлы и подменяем, чтобы не оставить кэш наполовину записанным
+    tmp_embs = EMBS_PATH + ".tmp"
+    with open(tmp_embs, "wb") as f:
+        np.save(f, np.ascontiguousarray(embs, dtype=np.float32))
+
+    tmp_meta = META_PATH + ".tmp"
+    if orjson is not None:
+        # orjson сериализует numpy-массивы напрямую, без .tolist()
+        meta = {
+            "ids": list(ids),
+            "names": list(names),
+            "offsets": np.ascontiguousarray(offsets, dtype=np.int64),
+            "confidences": np.ascontiguousarray(confidences, dtype=np.float32),
+        }
+        data = orjson.dumps(meta, option=orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        meta = {
+            "ids": list(ids),
+            "names": list(names),
+            "offsets": [int(o) for o in offsets],
+            "confidences": [float(c) for c in confidences],
+        }
+        data = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    with open(tmp_meta, "wb") as f:
+        f.write(data)
 
+    os.replace(tmp_embs, EMBS_PATH)
+    os.replace(tmp_meta, META_PATH)
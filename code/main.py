@@ -14,30 +14,44 @@ main.py — модульный home-sentinel для Immich.
 # Первым глушим C-level stdout/stderr
 import c_silence  # noqa: F401
 
+import functools
 import os
+import queue
+import threading
 import time
 import warnings
+from collections import OrderedDict
 from datetime import datetime
 
 # Настройка количества CPU потоков (должно быть до импорта cv2/numpy)
 import config
 num_threads = config.CPU_THREADS
-os.environ["OPENCV_NUM_THREADS"] = str(num_threads)
+os.environ["OPENCV_NUM_THREADS"] = str(config.OPENCV_THREADS)  # cv2.setNumThreads() — в camera.py
 os.environ["OMP_NUM_THREADS"] = str(num_threads)
 os.environ["MKL_NUM_THREADS"] = str(num_threads)
 os.environ["NUMEXPR_NUM_THREADS"] = str(num_threads)
 
 import cv2
-cv2.setNumThreads(num_threads)
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
 import stats
 
-from audio_detector import AudioDetector
+from audio_detector import create_audio_detector
 from camera import open_camera_stream
 from embeddings import load_or_refresh_cache
-from models import init_face_analysis, init_yolo
+from matching import (
+    best_match,
+    best_match_batch,
+    build_index,
+    conf_weights,
+    face_key,
+    quantize_gallery,
+    warmup as warmup_matching,
+)
+from models import (
+    face_embeddings, init_face_analysis, init_yolo, yolo_class_filters, yolo_class_names, yolo_predict
+)
 from mqtt_client import (
     init_mqtt, send_face_recognized, send_person_arrived, send_person_left,
     update_person_detected
@@ -48,6 +62,7 @@ from utils import (
     ensure_dirs,
     log,
     preprocess_face_crop,
+    save_jpeg,
     _l2_normalize,
 )
 
@@ -57,99 +72,140 @@ warnings.filterwarnings("ignore")
 # ============================================================
 # 🎨 Функция для отрисовки текста с поддержкой Unicode
 # ============================================================
-def draw_text_unicode(img, text, position, font_size=20, text_color=(255, 255, 255), bg_color=None):
-    """
-    Отрисовывает текст с поддержкой Unicode (включая русские символы) на изображении OpenCV.
-    
-    Args:
-        img: изображение OpenCV (BGR)
-        text: текст для отрисовки
-        position: (x, y) позиция текста
-        font_size: размер шрифта
-        text_color: цвет текста (RGB)
-        bg_color: цвет фона (RGB) или None
-    
-    Returns:
-        изображение с отрисованным текстом
-    """
-    # Конвертируем OpenCV изображение (BGR) в PIL (RGB)
-    img_pil = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-    draw = ImageDraw.Draw(img_pil)
-    
-    # Пытаемся загрузить шрифт, если не получается - используем default
+@functools.lru_cache(maxsize=None)
+def _load_font(font_size: int):
+    """TTF-шрифт нужного размера (загружается с диска один раз на размер)."""
     try:
         # Пробуем найти системный шрифт
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", font_size)
-    except:
+        return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", font_size)
+    except Exception:
         try:
             # Альтернативный путь
-            font = ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", font_size)
-        except:
+            return ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", font_size)
+        except Exception:
             # Используем default шрифт (может не поддерживать все символы)
-            font = ImageFont.load_default()
-    
-    # Получаем размеры текста
-    bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
-    
+            return ImageFont.load_default()
+
+
+def _text_color_for(bg_color, text_color):
+    """Автоматический выбор цвета текста по яркости фона (RGB): 0.299*R + 0.587*G + 0.114*B."""
+    if not bg_color:
+        return text_color
+    brightness = 0.299 * bg_color[0] + 0.587 * bg_color[1] + 0.114 * bg_color[2]
+    return (0, 0, 0) if brightness > 128 else (255, 255, 255)
+
+
+def _draw_text_ascii(img, text, position, font_size, text_color, bg_color):
+    """Латиница — сразу cv2.putText по кадру, без конвертации в PIL и обратно."""
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    scale = font_size / 30
+    (text_width, text_height), _ = cv2.getTextSize(text, font, scale, 1)
     x, y = position
-    
-    # Рисуем фон если указан
+
     if bg_color:
-        # Добавляем небольшой отступ
         padding = 3
-        draw.rectangle(
-            [(x - padding, y - text_height - padding - 2), (x + text_width + padding, y + padding)],
-            fill=bg_color,
-            outline=(0, 0, 0),  # Чёрная обводка рамки
-            width=1
-        )
-        
-        # Автоматический выбор цвета текста на основе яркости фона
-        # Формула яркости: 0.299*R + 0.587*G + 0.114*B
-        brightness = 0.299 * bg_color[0] + 0.587 * bg_color[1] + 0.114 * bg_color[2]
-        text_color = (0, 0, 0) if brightness > 128 else (255, 255, 255)
-    
-    # Рисуем текст с тенью для лучшей читаемости
+        p1 = (x - padding, y - text_height - padding - 2)
+        p2 = (x + text_width + padding, y + padding)
+        cv2.rectangle(img, p1, p2, bg_color[::-1], -1)  # RGB -> BGR
+        cv2.rectangle(img, p1, p2, (0, 0, 0), 1)  # Чёрная обводка рамки
+
+    text_color = _text_color_for(bg_color, text_color)
     shadow_color = (0, 0, 0) if text_color == (255, 255, 255) else (255, 255, 255)
-    draw.text((x + 1, y - text_height + 1), text, font=font, fill=shadow_color)  # Тень
-    draw.text((x, y - text_height), text, font=font, fill=text_color)
-    
-    # Конвертируем обратно в OpenCV (BGR)
-    return cv2.cvtColor(np.array(img_pil), cv2.COLOR_RGB2BGR)
+    cv2.putText(img, text, (x + 1, y + 1), font, scale, shadow_color[::-1], 1, cv2.LINE_AA)  # Тень
+    cv2.putText(img, text, (x, y), font, scale, text_color[::-1], 1, cv2.LINE_AA)
+    return img
 
 
-# ============================================================
-# 💡 Функция сходства лица и эмбеддингов человека
-# ============================================================
-def compute_face_similarity(
-    face_emb: np.ndarray,
-    person_embeddings_list: list,
-    person_confidences: list | None = None,
-) -> float:
+def draw_texts_unicode(img, items):
     """
-    Вычисляет максимальное сходство между лицом и всеми векторными представлениями человека.
-    Немного учитывает confidence, если он есть.
+    Отрисовывает несколько подписей за раз: items — [(text, position, font_size, text_color, bg_color), ...].
+    ASCII-подписи рисуются через cv2.putText на месте, остальные — в одном проходе PIL
+    (одна конвертация BGR -> RGB -> BGR на кадр, а не на подпись).
     """
-    if not person_embeddings_list:
-        return 0.0
+    unicode_items = []
+    for text, position, font_size, text_color, bg_color in items:
+        if text.isascii():
+            _draw_text_ascii(img, text, position, font_size, text_color, bg_color)
+        else:
+            unicode_items.append((text, position, font_size, text_color, bg_color))
+    if not unicode_items:
+        return img
 
-    face_emb = _l2_normalize(face_emb)
-    max_sim = -1.0
+    # Конвертируем OpenCV изображение (BGR) в PIL (RGB)
+    img_pil = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    draw = ImageDraw.Draw(img_pil)
 
-    for idx, emb in enumerate(person_embeddings_list):
-        emb = _l2_normalize(emb)
-        sim = float(np.dot(face_emb, emb))
+    for text, (x, y), font_size, text_color, bg_color in unicode_items:
+        font = _load_font(font_size)
+
+        # Получаем размеры текста
+        bbox = draw.textbbox((0, 0), text, font=font)
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+
+        # Рисуем фон если указан
+        if bg_color:
+            # Добавляем небольшой отступ
+            padding = 3
+            draw.rectangle(
+                [(x - padding, y - text_height - padding - 2), (x + text_width + padding, y + padding)],
+                fill=bg_color,
+                outline=(0, 0, 0),  # Чёрная обводка рамки
+                width=1
+            )
+        text_color = _text_color_for(bg_color, text_color)
+
+        # Рисуем текст с тенью для лучшей читаемости
+        shadow_color = (0, 0, 0) if text_color == (255, 255, 255) else (255, 255, 255)
+        draw.text((x + 1, y - text_height + 1), text, font=font, fill=shadow_color)  # Тень
+        draw.text((x, y - text_height), text, font=font, fill=text_color)
 
-        if person_confidences and idx < len(person_confidences):
-            conf = max(0.5, float(person_confidences[idx]))
-            sim *= (0.7 + 0.3 * conf)
+    # Конвертируем обратно в OpenCV (BGR)
+    return cv2.cvtColor(np.array(img_pil), cv2.COLOR_RGB2BGR)
 
-        if sim > max_sim:
-            max_sim = sim
 
-    return max_sim
+def has_screenshot_objects(labels) -> bool:
+    """Есть ли среди меток объекты из SCREENSHOT_OBJECTS (пустой список — скриншот для любых объектов)."""
+    if not config.SCREENSHOT_OBJECTS:
+        return True
+    for lbl in labels:
+        base = lbl.split("(", 1)[0] if "(" in lbl else lbl
+        if base.lower() in config.SCREENSHOT_OBJECTS:
+            return True
+    return False
+
+
+def same_person_boxes(prev: np.ndarray, cur: np.ndarray, min_iou: float) -> bool:
+    """
+    Те же ли люди на тех же местах: у каждого бокса person кадра есть свой (один к одному)
+    бокс прошлого кадра с IoU ≥ min_iou. Боксы — [x1, y1, x2, y2].
+    """
+    if len(prev) != len(cur) or len(cur) == 0:
+        return False
+    x1 = np.maximum(cur[:, None, 0], prev[None, :, 0])
+    y1 = np.maximum(cur[:, None, 1], prev[None, :, 1])
+    x2 = np.minimum(cur[:, None, 2], prev[None, :, 2])
+    y2 = np.minimum(cur[:, None, 3], prev[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_cur = (cur[:, 2] - cur[:, 0]) * (cur[:, 3] - cur[:, 1])
+    area_prev = (prev[:, 2] - prev[:, 0]) * (prev[:, 3] - prev[:, 1])
+    iou = inter / np.maximum(area_cur[:, None] + area_prev[None, :] - inter, 1)
+    best = iou.argmax(axis=1)
+    return bool(
+        (iou[np.arange(len(cur)), best] >= min_iou).all()
+        and len(np.unique(best)) == len(cur)
+    )
+
+
+# Разные параметры анти-дребезга для важных объектов (person, dog, cat) и остальных.
+# Метки повторяются из кадра в кадр — разбор строки делается один раз на метку
+@functools.lru_cache(maxsize=256)
+def get_debounce_params(label: str):
+    """Возвращает (max_missing, min_stable) для объекта."""
+    base = label.split("(", 1)[0] if "(" in label else label
+    if base in config.IMPORTANT_OBJECTS:
+        return config.MAX_MISSING, config.MIN_STABLE
+    return config.MAX_MISSING_OTHER, config.MIN_STABLE_OTHER
 
 
 # ============================================================
@@ -159,10 +215,12 @@ def recognize_objects_and_faces(
     stream,
     yolo,
     face_app,
-    all_embeddings_list: list,
+    gallery_embs: np.ndarray,
+    gallery_offsets: np.ndarray,
     names: list,
-    all_confidences_list: list,
+    gallery_weights: np.ndarray,
     audio_detector=None,
+    gallery_index=None,
 ):
     ensure_dirs()
     log("🎬 Запуск обработки видеопотока...")
@@ -171,15 +229,26 @@ def recognize_objects_and_faces(
     last_reported: set[str] = set()
     frame = 0
 
-    face_cache: dict[int, tuple[int, str | None, float]] = {}
+    # LRU: ключ лица -> (кадр, имя, сходство); старые записи вытесняются при вставке
+    face_cache: OrderedDict[int, tuple[int, str | None, float]] = OrderedDict()
     cache_validity = config.FACE_CACHE_VALIDITY_FRAMES
+
+    # Фильтр детекций по id класса (игнорируемые классы и пороги confidence)
+    ignore_mask, class_min_conf = yolo_class_filters(yolo)
+    class_names, person_cls = yolo_class_names(yolo)
     
     # Счетчик для уменьшения флуда логов при отсутствии кадров
     no_frame_count = 0
     last_no_frame_log = 0
     last_stream_frame_id = -1
+    last_detection = None  # (seen, detected_objects) последнего кадра с YOLO
+    last_face_frame = 0    # последний кадр, на котором запускалось распознавание лиц
+    last_face_boxes = np.empty((0, 4), dtype=np.int64)  # боксы person с лицами на прошлом кадре
     first_frame_processed = False
     warmup_times = []  # Для накопления времени прогрева
+    # Сводка по стадиям за PERF_LOG_INTERVAL: кадров, сумма времени YOLO / лиц / всего кадра
+    perf_frames, perf_yolo, perf_face, perf_total = 0, 0.0, 0.0, 0.0
+    perf_start = time.time()
     
     # Словарь эмодзи для разных объектов
     object_emojis = {
@@ -220,6 +289,166 @@ def recognize_objects_and_faces(
         "mouse": (100, 50, 150),       # Бордовый
     }
 
+    def report_changes(frame, img, current, previous, seen, detected_objects):
+        """Логирует изменения состава кадра, сохраняет скриншот и отправляет события."""
+        if current == previous:
+            return
+
+        added = current - previous
+        removed = previous - current
+
+        # Подсчитываем количество person в текущем кадре
+        person_count = sum(1 for c in current if c == "person" or c.startswith("person("))
+
+        # Обновляем статус "человек в кадре" в Home Assistant
+        update_person_detected(person_count > 0)
+
+        # Списки для логирования
+        faces_recognized = []  # Лица, которые распознаны
+        truly_added = []       # Объекты, которые реально появились
+        truly_removed = []     # Объекты, которые реально ушли
+
+        # Обрабатываем added
+        for a in added:
+            if a.startswith("person("):
+                # Лицо распознано
+                name = a[7:-1]  # Извлекаем имя из "person(Имя)"
+                # Если был просто person, это распознание лица, а не появление нового человека
+                if "person" in removed:
+                    faces_recognized.append(name)
+                else:
+                    # Новый человек сразу распознан
+                    faces_recognized.append(name)
+            elif a == "person":
+                # Новый person появился
+                # Не логируем если одновременно появился person(Имя) — это дубликат
+                named_added = any(x.startswith("person(") for x in added)
+                if not named_added:
+                    truly_added.append(a)
+            else:
+                truly_added.append(a)
+
+        # Обрабатываем removed
+        for r in removed:
+            if r.startswith("person("):
+                # Лицо пропало
+                # Логируем только если person тоже пропал (человек ушёл)
+                # Если person остался или появился — лицо просто перестало распознаваться
+                person_still_here = "person" in current or "person" in added
+                if not person_still_here:
+                    truly_removed.append(r)
+            elif r == "person":
+                # person пропал
+                # Не логируем если появился person(Имя) — это распознание лица
+                named_added = any(x.startswith("person(") for x in added)
+                if not named_added:
+                    truly_removed.append(r)
+            else:
+                truly_removed.append(r)
+
+        # Логируем только значимые изменения
+        has_changes = faces_recognized or truly_added or truly_removed
+        if has_changes:
+            # Логируем детали кадра
+            log(f"📸 Кадр {frame}: Обнаружены объекты:")
+
+            # Создаем словарь объектов по label для логирования
+            objects_by_label = {}
+            for obj in detected_objects:
+                label = obj["label"]
+                for seen_label in seen.keys():
+                    if seen_label.startswith("person(") and label == "person":
+                        label = seen_label
+                        break
+                if label not in objects_by_label or obj["confidence"] > objects_by_label[label]["confidence"]:
+                    objects_by_label[label] = obj
+
+            # Логируем объекты
+            for label in sorted(current):
+                if label in objects_by_label:
+                    obj = objects_by_label[label]
+                    log(
+                        f"   {obj['emoji']} {label} "
+                        f"(confidence: {obj['confidence']:.2f}) "
+                        f"[x: {obj['x']}, y: {obj['y']}, w: {obj['w']}, h: {obj['h']}]"
+                    )
+                else:
+                    emoji = object_emojis.get(label.split("(")[0] if "(" in label else label, "📦")
+                    log(f"   {emoji} {label}")
+
+            # Сохраняем скриншот только при появлении заданных в .env объектов (person, dog и т.д.)
+            current_screenshot_path = None
+            # img передаётся только если скриншот нужен (см. has_screenshot_objects)
+            if img is not None:
+                img_with_boxes = img
+                label_items = []  # подписи рисуются одним проходом после всех рамок
+                for obj in detected_objects:
+                    label = obj["label"]
+                    display_label = label
+                    for seen_label in seen.keys():
+                        if seen_label.startswith("person(") and label == "person":
+                            display_label = seen_label
+                            break
+
+                    x1, y1 = obj['x'], obj['y']
+                    x2, y2 = x1 + obj['w'], y1 + obj['h']
+                    color = object_colors.get(label, (255, 0, 0))
+                    line_width = 3 if label == "person" else 2
+                    cv2.rectangle(img_with_boxes, (x1, y1), (x2, y2), (0, 0, 0), line_width + 2)
+                    cv2.rectangle(img_with_boxes, (x1, y1), (x2, y2), color, line_width)
+
+                    label_text = f"{display_label} {obj['confidence']:.2f}"
+                    bg_color_rgb = (color[2], color[1], color[0])
+                    font_size = 18 if label == "person" else 16
+                    text_color = (255, 255, 255)
+                    label_items.append((label_text, (x1, y1), font_size, text_color, bg_color_rgb))
+                img_with_boxes = draw_texts_unicode(img_with_boxes, label_items)
+
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                current_screenshot_path = os.path.join(
+                    config.SCREENSHOTS_DIR,
+                    f"frame_{timestamp}_{frame}.jpg"
+                )
+                save_jpeg(current_screenshot_path, img_with_boxes)
+                log(f"💾 Скриншот сохранен: {current_screenshot_path}")
+
+            # Логируем появления (не-person объекты)
+            if truly_added:
+                log(f"➕ Появились: {', '.join(sorted(truly_added))}")
+
+            # Логируем распознанные лица и отправляем в MQTT
+            for name in faces_recognized:
+                log(f"👤 Распознано лицо на кадре: {name}")
+                # Формируем URL скриншота для MQTT image entity
+                screenshot_url = None
+                if current_screenshot_path and config.SCREENSHOTS_WEB_URL:
+                    filename = os.path.basename(current_screenshot_path)
+                    screenshot_url = f"{config.SCREENSHOTS_WEB_URL.rstrip('/')}/screenshots/{filename}"
+                send_face_recognized(name, frame=frame, screenshot_url=screenshot_url)
+                # Уведомляем трекер присутствия (с путём к скриншоту)
+                tracker = get_tracker()
+                if tracker:
+                    tracker.on_face_recognized(name, current_screenshot_path)
+
+            # Логируем уходы
+            if truly_removed:
+                log(f"➖ Ушли: {', '.join(sorted(truly_removed))}")
+
+    def report_loop():
+        """Поток отчётов: разбирает очередь кадров, не задерживая детекцию на I/O."""
+        while True:
+            frame, img, current, previous, seen, detected_objects, stats_names = report_q.get()
+            try:
+                for name in stats_names:
+                    stats.record_person_seen(name)
+                report_changes(frame, img, current, previous, seen, detected_objects)
+            except Exception as e:
+                log(f"⚠️ Ошибка обработки событий кадра {frame}: {e}")
+
+    # Ограниченная очередь: если отчёты не успевают, детекция ждёт, а не копит кадры в памяти
+    report_q: queue.Queue = queue.Queue(maxsize=2)
+    threading.Thread(target=report_loop, daemon=True, name="Reporter").start()
+
     while True:
         if stream is None:
             log("🔄 Камера недоступна, пробую подключиться...")
@@ -227,7 +456,7 @@ def recognize_objects_and_faces(
             stream = open_camera_stream()
             continue
 
-        img, stream_frame_id, last_ok_ts = stream.get_latest()
+        img, img_small, stream_frame_id, last_ok_ts = stream.get_latest_pair()
         now = time.time()
 
         # Если нет новых кадров — ждём. Если поток “застрял” (давно не было успешных read) — считаем как no-frame.
@@ -289,82 +518,93 @@ def recognize_objects_and_faces(
             log("🔥 Прогрев нейросетей (первые кадры обрабатываются медленнее)...")
             first_frame_processed = True
         
+        # YOLO и лица — раз в DETECT_EVERY_N кадров, между ними повторяем последний результат детекции
+        detect = last_detection is None or (frame - 1) % config.DETECT_EVERY_N == 0
+
         # Замер времени YOLO
         yolo_start = time.time()
         
-        # Используем настроенный размер изображения для обработки
-        results = yolo.predict(
-            img,
-            imgsz=config.YOLO_IMGSZ,
-            half=config.YOLO_FP16,
-            verbose=False,
-        )
+        if detect:
+            # Используем настроенный размер изображения для обработки.
+            # Кадр уже уменьшен потоком чтения — боксы потом масштабируем обратно
+            yolo_img = img_small if img_small is not None else img
+            # По осям отдельно: при округлении размера уменьшенного кадра пропорции чуть расходятся
+            sx, sy = img.shape[1] / yolo_img.shape[1], img.shape[0] / yolo_img.shape[0]
+            box_scale = None if sx == 1.0 and sy == 1.0 else np.array((sx, sy, sx, sy), dtype=np.float32)
+            results = yolo_predict(yolo, yolo_img)
+        else:
+            results = ()
         
         yolo_time = time.time() - yolo_start
         seen: dict[str, bool] = {}
+        stats_names: list[str] = []  # распознанные лица для записи статистики
         face_time = 0.0  # Счётчик времени на распознавание лиц
 
         # ---------------- YOLO ----------------
         detected_objects = []  # Список для логирования
-        
-        for r in results:
-            boxes = r.boxes.xyxy.cpu().numpy()
-            classes = r.boxes.cls.cpu().numpy().astype(int)
-            confidences = r.boxes.conf.cpu().numpy()  # Получаем confidence
+        face_crops: list[np.ndarray] = []  # crop вокруг person для поиска лиц
+        face_sizes: list[int] = []         # размер бокса person (для адаптивного порога)
+        face_boxes: list[np.ndarray] = []  # бокс person для каждого crop (сверка с прошлым кадром)
+        if not detect:
+            seen = dict(last_detection[0])
+            detected_objects = last_detection[1]
+        img_h, img_w = img.shape[:2]  # размер кадра не меняется внутри кадра — читаем один раз
 
-            for (x1, y1, x2, y2), cls, conf in zip(boxes, classes, confidences):
-                label = yolo.names.get(cls, str(cls))
-                
-                # Пропускаем игнорируемые классы
-                if label in config.YOLO_IGNORE_CLASSES:
-                    continue
-                
-                # Фильтрация по минимальному confidence (разные пороги для person и остальных)
-                threshold = config.YOLO_PERSON_CONFIDENCE if label == "person" else config.YOLO_CONFIDENCE_THRESHOLD
-                if conf < threshold:
-                    continue
+        for r in results:
+            # Одна передача GPU -> CPU на кадр: data = [x1, y1, x2, y2, conf, cls]
+            data = r.boxes.data.cpu().numpy()
+            boxes = data[:, :4]
+            if box_scale is not None:
+                boxes *= box_scale
+            confidences = data[:, 4]
+            classes = data[:, 5].astype(np.intp)
+
+            # Игнорируемые классы и минимальный confidence (разные пороги для person и остальных) — одной маской
+            keep = ~ignore_mask[classes] & (confidences >= class_min_conf[classes])
+
+            boxes, classes, confidences = boxes[keep], classes[keep], confidences[keep]
+
+            # Границы кадра и padding вокруг боксов (для crop лиц) — сразу для всех боксов
+            bi = boxes.astype(np.int64)
+            x1i, y1i = np.maximum(bi[:, 0], 0), np.maximum(bi[:, 1], 0)
+            x2i, y2i = np.minimum(bi[:, 2], img_w), np.minimum(bi[:, 3], img_h)
+            box_w, box_h = x2i - x1i, y2i - y1i
+            pad = config.FACE_PADDING_RATIO
+            crop_boxes = np.stack([
+                np.maximum(0, (x1i - box_w * pad).astype(np.int64)),
+                np.maximum(0, (y1i - box_h * pad).astype(np.int64)),
+                np.minimum(img_w, (x2i + box_w * pad).astype(np.int64)),
+                np.minimum(img_h, (y2i + box_h * pad).astype(np.int64)),
+            ], axis=1)
+            box_ok = (box_w > 0) & (box_h > 0)
+            box_size = np.maximum(box_w, box_h)
+
+            labels = class_names[classes]
+
+            # Координаты, классы и confidence — в int/float Python один раз на кадр, а не по полю на бокс
+            rows = zip(bi.tolist(), classes.tolist(), confidences.tolist(), labels)
+            for i, ((x1, y1, x2, y2), cls, conf, label) in enumerate(rows):
                 
                 # Сохраняем информацию об объекте для логирования
                 emoji = object_emojis.get(label, "📦")
-                w = int(x2 - x1)
-                h = int(y2 - y1)
                 detected_objects.append({
                     "label": label,
                     "emoji": emoji,
-                    "confidence": float(conf),
-                    "x": int(x1),
-                    "y": int(y1),
-                    "w": w,
-                    "h": h
+                    "confidence": conf,
+                    "x": x1,
+                    "y": y1,
+                    "w": x2 - x1,
+                    "h": y2 - y1
                 })
 
-                # всегда считаем person как базовую сущность
-                if label == "person":
-                    seen["person"] = True
-                else:
-                    seen[label] = True
+                # person — базовая сущность, имена добавляются после распознавания лиц
+                seen[label] = True
 
                 # если это не person — лица не ищем
-                if label != "person" or len(all_embeddings_list) == 0:
+                if cls != person_cls or len(gallery_embs) == 0 or not box_ok[i]:
                     continue
 
-                h, w = img.shape[:2]
-                x1i, y1i = max(0, int(x1)), max(0, int(y1))
-                x2i, y2i = min(w, int(x2)), min(h, int(y2))
-
-                if x2i <= x1i or y2i <= y1i:
-                    continue
-
-                # padding вокруг bounding box
-                box_w = x2i - x1i
-                box_h = y2i - y1i
-                pad = config.FACE_PADDING_RATIO
-
-                x1p = max(0, int(x1i - box_w * pad))
-                y1p = max(0, int(y1i - box_h * pad))
-                x2p = min(w, int(x2i + box_w * pad))
-                y2p = min(h, int(y2i + box_h * pad))
-
+                x1p, y1p, x2p, y2p = crop_boxes[i].tolist()
                 crop = img[y1p:y2p, x1p:x2p]
                 if (
                     crop.size == 0
@@ -373,113 +613,129 @@ def recognize_objects_and_faces(
                 ):
                     continue
 
-                crop = preprocess_face_crop(crop)
-
-                try:
-                    face_start = time.time()
-                    faces = face_app.get(crop, max_num=config.MAX_FACES_PER_CROP)
-                    face_time += time.time() - face_start
-                except Exception:
-                    faces = []
-
-                if not faces:
-                    continue
-
-                recognized_names: set[str] = set()
-
-                # ----------- распознаём все лица в crop -----------
-                for face in faces:
+                face_crops.append(preprocess_face_crop(crop))
+                face_sizes.append(int(box_size[i]))
+                face_boxes.append(bi[i])
+
+        # ----------- Лица: детекция по crop, распознавание — одним батчем на все лица кадра -----------
+        crop_embs = []
+        # Если все person в кадре уже стабильно опознаны и стоят на тех же местах, что на прошлом кадре, —
+        # лица не ищем, имена берём из анти-дребезга. Любой сдвиг боксов (вошёл другой человек,
+        # люди поменялись местами) и раз в FACE_REFRESH_FRAMES кадров — распознаём заново
+        stable_names = [
+            lbl[7:-1] for lbl, v in tracked.items()
+            if lbl.startswith("person(") and v["last"] == 0 and v["stable"] >= config.MIN_STABLE
+        ]
+        cur_face_boxes = np.array(face_boxes, dtype=np.int64).reshape(-1, 4)
+        prev_face_boxes = last_face_boxes
+        if detect:
+            last_face_boxes = cur_face_boxes
+        if (
+            face_crops
+            and len(stable_names) == len(face_crops)
+            and same_person_boxes(prev_face_boxes, cur_face_boxes, config.FACE_SKIP_IOU)
+            and "person" not in tracked
+            and frame - last_face_frame < config.FACE_REFRESH_FRAMES
+        ):
+            seen.pop("person", None)
+            for nm in stable_names:
+                seen[f"person({nm})"] = True
+            # Статистику не пишем: она записывается при настоящем распознавании раз в FACE_REFRESH_FRAMES
+            face_crops = []
+        elif face_crops:
+            last_face_frame = frame
+            try:
+                face_start = time.time()
+                crop_embs = face_embeddings(face_app, face_crops, config.MAX_FACES_PER_CROP)
+                face_time += time.time() - face_start
+            except Exception:
+                crop_embs = []
+
+        # ----------- распознаём все лица кадра: сначала кэш, затем одно сопоставление с базой на все промахи -----------
+        crop_names: list[set[str]] = [set() for _ in crop_embs]
+        pending = []  # (номер crop, ключ кэша, нормализованный вектор)
+        for ci, crop_faces in enumerate(crop_embs):
+            for face_emb in crop_faces:
+                face_emb = _l2_normalize(face_emb)
+                face_hash = face_key(face_emb)
+                cached = face_cache.get(face_hash)
+                if cached is not None:
+                    cached_frame, cached_name, cached_sim = cached
+                    if frame - cached_frame < cache_validity and cached_name:
+                        face_cache.move_to_end(face_hash)
+                        crop_names[ci].add(cached_name)
+                        continue
+                    del face_cache[face_hash]
+                pending.append((ci, face_hash, face_emb))
+
+        matches = []
+        if pending:
+            try:
+                probes = np.stack([emb for _, _, emb in pending])
+                best_idx, best_sims, second_sims = best_match_batch(
+                    probes, gallery_embs, gallery_offsets, gallery_weights, gallery_index
+                )
+                matches = list(zip(pending, best_idx.tolist(), best_sims.tolist(), second_sims.tolist()))
+            except Exception:
+                # Батч не прошёл (например, вектор другой размерности) — сопоставляем лица по одному,
+                # чтобы одно плохое лицо не отменяло распознавание остальных
+                for item in pending:
                     try:
-                        face_emb = np.asarray(face.embedding, dtype=np.float32)
-                        if face_emb.ndim != 1:
-                            continue
-
-                        face_hash = hash(tuple(face_emb[:10].astype(int)))
-                        if face_hash in face_cache:
-                            cached_frame, cached_name, cached_sim = face_cache[face_hash]
-                            if frame - cached_frame < cache_validity and cached_name:
-                                recognized_names.add(cached_name)
-                                continue
-
-                        sims: list[tuple[float, int, str | None]] = []
-
-                        for idx, person_embs in enumerate(all_embeddings_list):
-                            confs = (
-                                all_confidences_list[idx]
-                                if idx < len(all_confidences_list)
-                                else None
-                            )
-                            sim = compute_face_similarity(face_emb, person_embs, confs)
-                            pname = names[idx] if idx < len(names) else None
-                            sims.append((sim, idx, pname))
-
-                        if not sims:
-                            continue
-
-                        sims.sort(reverse=True, key=lambda x: x[0])
-                        best_sim, best_idx, best_name = sims[0]
-                        second_sim = sims[1][0] if len(sims) > 1 else 0.0
-                        diff = best_sim - second_sim
-
-                        face_size = max(box_w, box_h)
-                        thr = adaptive_threshold(face_size, config.FACE_SIM_THRESHOLD)
-
-                        high = best_sim >= thr + 0.1
-                        good_diff = diff >= config.MIN_SIM_DIFF
-
-                        if best_sim >= thr and (good_diff or high) and best_name:
-                            if high:
-                                face_cache[face_hash] = (frame, best_name, best_sim)
-
-                            recognized_names.add(best_name)
-                            stats.record_person_seen(best_name)
-
-                            # Логирование распознавания лиц убрано для уменьшения флуда
-                            # Информация о распознанных лицах будет в логах "➕ Появились: person(Имя)"
-                        else:
-                            # Диагностический лог (опционально)
-                            pass
-
+                        matches.append((item, *best_match(item[2], gallery_embs, gallery_offsets, gallery_weights)))
                     except Exception:
                         # локальные ошибки — не роняем поток
-                        pass
-
-                # если кого-то узнали — заменяем base "person" на именованные
-                if recognized_names:
-                    if "person" in seen:
-                        del seen["person"]
+                        continue
+
+        for (ci, face_hash, _), best_idx, best_sim, second_sim in matches:
+            if best_idx < 0:
+                continue
+            best_name = names[best_idx]
+            diff = best_sim - second_sim
+
+            thr = adaptive_threshold(face_sizes[ci], config.FACE_SIM_THRESHOLD)
+
+            high = best_sim >= thr + 0.1
+            good_diff = diff >= config.MIN_SIM_DIFF
+
+            if best_sim >= thr and (good_diff or high) and best_name:
+                if high:
+                    face_cache[face_hash] = (frame, best_name, best_sim)
+                    face_cache.move_to_end(face_hash)
+                    if len(face_cache) > config.MAX_FACE_CACHE:
+                        face_cache.popitem(last=False)
+
+                crop_names[ci].add(best_name)
+                stats_names.append(best_name)
+
+                # Логирование распознавания лиц убрано для уменьшения флуда
+                # Информация о распознанных лицах будет в логах "➕ Появились: person(Имя)"
+
+        for recognized_names in crop_names:
+            # если кого-то узнали — заменяем base "person" на именованные
+            if recognized_names:
+                if "person" in seen:
+                    del seen["person"]
+                for nm in recognized_names:
+                    seen[f"person({nm})"] = True
+
+                # ВАЖНО: переносим состояние анти-дребезга с "person" на "person(Имя)",
+                # чтобы имя сразу попадало в current/лог (а не спустя десятки кадров).
+                if "person" in tracked:
+                    base_state = tracked.pop("person")
+                    base_last = int(base_state.get("last", 0))
+                    base_stable = int(base_state.get("stable", 1))
                     for nm in recognized_names:
-                        seen[f"person({nm})"] = True
-
-                    # ВАЖНО: переносим состояние анти-дребезга с "person" на "person(Имя)",
-                    # чтобы имя сразу попадало в current/лог (а не спустя десятки кадров).
-                    if "person" in tracked:
-                        base_state = tracked.pop("person")
-                        base_last = int(base_state.get("last", 0))
-                        base_stable = int(base_state.get("stable", 1))
-                        for nm in recognized_names:
-                            key = f"person({nm})"
-                            if key not in tracked:
-                                tracked[key] = {"last": base_last, "stable": base_stable}
-                            else:
-                                tracked[key]["last"] = min(int(tracked[key].get("last", 0)), base_last)
-                                tracked[key]["stable"] = max(int(tracked[key].get("stable", 1)), base_stable)
-
-                # периодическая чистка кэша
-                if frame % 100 == 0:
-                    face_cache = {
-                        k: v for k, v in face_cache.items() if frame - v[0] < cache_validity
-                    }
+                        key = f"person({nm})"
+                        if key not in tracked:
+                            tracked[key] = {"last": base_last, "stable": base_stable}
+                        else:
+                            tracked[key]["last"] = min(int(tracked[key].get("last", 0)), base_last)
+                            tracked[key]["stable"] = max(int(tracked[key].get("stable", 1)), base_stable)
+
+        if detect:
+            last_detection = (seen, detected_objects)
 
         # ---------------- Анти-дребезг ----------------
-        # Разные параметры для важных объектов (person, dog, cat) и остальных
-        def get_debounce_params(label: str):
-            """Возвращает (max_missing, min_stable) для объекта."""
-            base = label.split("(", 1)[0] if "(" in label else label
-            if base in config.IMPORTANT_OBJECTS:
-                return config.MAX_MISSING, config.MIN_STABLE
-            return config.MAX_MISSING_OTHER, config.MIN_STABLE_OTHER
-        
         for lbl in list(tracked.keys()):
             max_missing, min_stable = get_debounce_params(lbl)
             if lbl not in seen:
@@ -506,155 +762,13 @@ def recognize_objects_and_faces(
             if v["stable"] >= get_debounce_params(lbl)[1]
         }
 
-        if current != last_reported:
-            added = current - last_reported
-            removed = last_reported - current
-            
-            # Подсчитываем количество person в текущем кадре
-            person_count = sum(1 for c in current if c == "person" or c.startswith("person("))
-            
-            # Обновляем статус "человек в кадре" в Home Assistant
-            update_person_detected(person_count > 0)
-            
-            # Списки для логирования
-            faces_recognized = []  # Лица, которые распознаны
-            truly_added = []       # Объекты, которые реально появились
-            truly_removed = []     # Объекты, которые реально ушли
-            
-            # Обрабатываем added
-            for a in added:
-                if a.startswith("person("):
-                    # Лицо распознано
-                    name = a[7:-1]  # Извлекаем имя из "person(Имя)"
-                    # Если был просто person, это распознание лица, а не появление нового человека
-                    if "person" in removed:
-                        faces_recognized.append(name)
-                    else:
-                        # Новый человек сразу распознан
-                        faces_recognized.append(name)
-                elif a == "person":
-                    # Новый person появился
-                    # Не логируем если одновременно появился person(Имя) — это дубликат
-                    named_added = any(x.startswith("person(") for x in added)
-                    if not named_added:
-                        truly_added.append(a)
-                else:
-                    truly_added.append(a)
-            
-            # Обрабатываем removed
-            for r in removed:
-                if r.startswith("person("):
-                    # Лицо пропало
-                    # Логируем только если person тоже пропал (человек ушёл)
-                    # Если person остался или появился — лицо просто перестало распознаваться
-                    person_still_here = "person" in current or "person" in added
-                    if not person_still_here:
-                        truly_removed.append(r)
-                elif r == "person":
-                    # person пропал
-                    # Не логируем если появился person(Имя) — это распознание лица
-                    named_added = any(x.startswith("person(") for x in added)
-                    if not named_added:
-                        truly_removed.append(r)
-                else:
-                    truly_removed.append(r)
-
-            # Логируем только значимые изменения
-            has_changes = faces_recognized or truly_added or truly_removed
-            if has_changes:
-                # Логируем детали кадра
-                log(f"📸 Кадр {frame}: Обнаружены объекты:")
-                
-                # Создаем словарь объектов по label для логирования
-                objects_by_label = {}
-                for obj in detected_objects:
-                    label = obj["label"]
-                    for seen_label in seen.keys():
-                        if seen_label.startswith("person(") and label == "person":
-                            label = seen_label
-                            break
-                    if label not in objects_by_label or obj["confidence"] > objects_by_label[label]["confidence"]:
-                        objects_by_label[label] = obj
-                
-                # Логируем объекты
-                for label in sorted(current):
-                    if label in objects_by_label:
-                        obj = objects_by_label[label]
-                        log(
-                            f"   {obj['emoji']} {label} "
-                            f"(confidence: {obj['confidence']:.2f}) "
-                            f"[x: {obj['x']}, y: {obj['y']}, w: {obj['w']}, h: {obj['h']}]"
-                        )
-                    else:
-                        emoji = object_emojis.get(label.split("(")[0] if "(" in label else label, "📦")
-                        log(f"   {emoji} {label}")
-                
-                # Сохраняем скриншот только при появлении заданных в .env объектов (person, dog и т.д.)
-                current_screenshot_path = None
-                def _current_has_screenshot_objects():
-                    if not config.SCREENSHOT_OBJECTS:
-                        return True
-                    for lbl in current:
-                        base = lbl.split("(", 1)[0] if "(" in lbl else lbl
-                        if base.lower() in config.SCREENSHOT_OBJECTS:
-                            return True
-                    return False
-                if config.SCREENSHOTS_ENABLED and _current_has_screenshot_objects():
-                    img_with_boxes = img.copy()
-                    for obj in detected_objects:
-                        label = obj["label"]
-                        display_label = label
-                        for seen_label in seen.keys():
-                            if seen_label.startswith("person(") and label == "person":
-                                display_label = seen_label
-                                break
-                        
-                        x1, y1 = obj['x'], obj['y']
-                        x2, y2 = x1 + obj['w'], y1 + obj['h']
-                        color = object_colors.get(label, (255, 0, 0))
-                        line_width = 3 if label == "person" else 2
-                        cv2.rectangle(img_with_boxes, (x1, y1), (x2, y2), (0, 0, 0), line_width + 2)
-                        cv2.rectangle(img_with_boxes, (x1, y1), (x2, y2), color, line_width)
-                        
-                        label_text = f"{display_label} {obj['confidence']:.2f}"
-                        bg_color_rgb = (color[2], color[1], color[0])
-                        font_size = 18 if label == "person" else 16
-                        text_color = (255, 255, 255)
-                        img_with_boxes = draw_text_unicode(
-                            img_with_boxes, label_text, (x1, y1),
-                            font_size=font_size, text_color=text_color, bg_color=bg_color_rgb
-                        )
-                    
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    current_screenshot_path = os.path.join(
-                        config.SCREENSHOTS_DIR,
-                        f"frame_{timestamp}_{frame}.jpg"
-                    )
-                    cv2.imwrite(current_screenshot_path, img_with_boxes)
-                    log(f"💾 Скриншот сохранен: {current_screenshot_path}")
-
-                # Логируем появления (не-person объекты)
-                if truly_added:
-                    log(f"➕ Появились: {', '.join(sorted(truly_added))}")
-                
-                # Логируем распознанные лица и отправляем в MQTT
-                for name in faces_recognized:
-                    log(f"👤 Распознано лицо на кадре: {name}")
-                    # Формируем URL скриншота для MQTT image entity
-                    screenshot_url = None
-                    if current_screenshot_path and config.SCREENSHOTS_WEB_URL:
-                        filename = os.path.basename(current_screenshot_path)
-                        screenshot_url = f"{config.SCREENSHOTS_WEB_URL.rstrip('/')}/screenshots/{filename}"
-                    send_face_recognized(name, frame=frame, screenshot_url=screenshot_url)
-                    # Уведомляем трекер присутствия (с путём к скриншоту)
-                    tracker = get_tracker()
-                    if tracker:
-                        tracker.on_face_recognized(name, current_screenshot_path)
-                
-                # Логируем уходы
-                if truly_removed:
-                    log(f"➖ Ушли: {', '.join(sorted(truly_removed))}")
-
+        if stats_names or current != last_reported:
+            # Логи, скриншот, MQTT и запись статистики — в потоке отчётов. Кадр передаём копией:
+            # его буфер переиспользуется потоком чтения камеры
+            report_img = None
+            if current != last_reported and config.SCREENSHOTS_ENABLED and has_screenshot_objects(current):
+                report_img = img.copy()
+            report_q.put((frame, report_img, current, last_reported, seen, detected_objects, stats_names))
             last_reported = current
         
         # Диагностика времени обработки для первых кадров (прогрев)
@@ -673,6 +787,24 @@ def recognize_objects_and_faces(
         elif frame == 16:
             log("✅ Прогрев завершён, система работает в штатном режиме")
 
+        # Какая стадия ограничивает FPS — видно без профилировщика
+        if config.PERF_LOG_INTERVAL > 0:
+            now = time.time()
+            perf_frames += 1
+            perf_yolo += yolo_time
+            perf_face += face_time
+            perf_total += now - frame_start_time
+            elapsed = now - perf_start
+            if elapsed >= config.PERF_LOG_INTERVAL:
+                log(
+                    f"📊 {perf_frames / elapsed:.1f} кадр/с; в среднем на кадр: "
+                    f"YOLO {perf_yolo / perf_frames * 1000:.0f} мс, "
+                    f"лица {perf_face / perf_frames * 1000:.0f} мс, "
+                    f"всего {perf_total / perf_frames * 1000:.0f} мс"
+                )
+                perf_frames, perf_yolo, perf_face, perf_total = 0, 0.0, 0.0, 0.0
+                perf_start = now
+
 
 # ============================================================
 # 🚀 MAIN
@@ -684,18 +816,21 @@ if __name__ == "__main__":
         # Инициализация таблиц статистики
         stats.init_tables()
 
-        # 1. Подключаемся к видеопотоку
+        # 1. Загружаем аудио-детектор ДО видеопотока: с SHARED_FFMPEG аудиопайп общего ffmpeg
+        # начинает читаться только после audio.start(), а пока грузится YAMNet,
+        # переполненный пайп остановил бы ffmpeg, а с ним и видео
+        audio = None
+        if config.YAMNET_CLASSES:
+            audio = create_audio_detector()
+
+        # 2. Подключаемся к видеопотоку и запускаем аудио-детектор в фоне
         stream = open_camera_stream()
         if stream is None:
             time.sleep(5)
             stream = open_camera_stream()
             if stream is None:
                 raise RuntimeError("Камера недоступна")
-
-        # 2. Запускаем аудио-детектор в фоне (детекция начнётся после инициализации)
-        audio = None
-        if config.YAMNET_CLASSES:
-            audio = AudioDetector()
+        if audio is not None:
             audio.start()
 
         # 3. Инициализация моделей
@@ -703,7 +838,12 @@ if __name__ == "__main__":
         face_app = init_face_analysis()
 
         # 4. Загружаем векторные представления лиц из Immich
-        all_embeddings_list, names, ids, all_confidences_list = load_or_refresh_cache()
+        gallery_embs, gallery_offsets, names, ids, gallery_confs = load_or_refresh_cache()
+        if config.FACE_MATCH_INT8 and len(gallery_embs):
+            gallery_embs = quantize_gallery(gallery_embs)
+        gallery_weights = conf_weights(gallery_confs)
+        warmup_matching(gallery_embs, gallery_offsets, gallery_weights)
+        gallery_index = build_index(gallery_embs, gallery_offsets, gallery_weights)
 
         # 5. Подключаемся к MQTT для интеграции с Home Assistant
         init_mqtt()
@@ -727,4 +867,7 @@ if __name__ == "__main__":
         audio.enable()
 
     # Запускаем основной цикл видео
-    recognize_objects_and_faces(stream, yolo, face_app, all_embeddings_list, names, all_confidences_list, audio)
+    recognize_objects_and_faces(
+        stream, yolo, face_app, gallery_embs, gallery_offsets, names, gallery_weights, audio,
+        gallery_index=gallery_index,
+    )
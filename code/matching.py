@@ -0,0 +1,284 @@
+# matching.py
+"""
+Сопоставление лица с базой лиц из Immich.
+База — одна матрица embs (N, D), L2-нормализованная, и смещения offsets по людям
+(векторы человека i: embs[offsets[i]:offsets[i + 1]]).
+"""
+
+import numpy as np
+
+import config
+from utils import log
+
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:  # numba опционален: без него сходство считается через NumPy
+    njit = None
+
+try:
+    import hnswlib
+except ImportError:  # hnswlib опционален: без него база всегда сканируется целиком
+    hnswlib = None
+
+# Масштаб квантования векторов в int8 (единичный вектор -> [-127, 127])
+_INT8_SCALE = 127
+
+
+def conf_weights(confs: np.ndarray) -> np.ndarray:
+    """Веса векторов по confidence: 0.7 + 0.3 * max(0.5, conf). Считаются один раз при загрузке базы."""
+    return (0.7 + 0.3 * np.maximum(0.5, np.asarray(confs, dtype=np.float32))).astype(np.float32)
+
+
+def _person_scores_np(sims, offsets, weights):
+    """Лучшее сходство по каждому человеку (NumPy) из сырых сходств sims = embs @ probe."""
+    sims *= weights
+    return np.maximum.reduceat(sims, offsets[:-1])
+
+
+def _top2_np(scores):
+    if scores.size == 0:
+        return -1, -1.0, 0.0
+    if scores.size == 1:
+        return 0, float(scores[0]), 0.0
+    # Два лучших за один O(N) проход, затем упорядочиваем их между собой
+    top2 = np.argpartition(scores, -2)[-2:]
+    second_idx, best_idx = top2[np.argsort(scores[top2])]
+    return int(best_idx), float(scores[best_idx]), float(scores[second_idx])
+
+
+if njit is not None:
+    @njit(fastmath=True, cache=True)
+    def _top2_nb(scores):
+        # Сходства косинусные (>= -1): стартуем с -2.0, а не -inf — fastmath предполагает, что бесконечностей нет
+        best_idx = -1
+        best_sim = -2.0
+        second_sim = -2.0
+        for p in range(scores.shape[0]):
+            s = scores[p]
+            if s > best_sim:
+                second_sim = best_sim
+                best_sim = s
+                best_idx = p
+            elif s > second_sim:
+                second_sim = s
+        if scores.shape[0] < 2:
+            second_sim = 0.0
+        if scores.shape[0] == 0:
+            best_sim = -1.0
+        return best_idx, best_sim, second_sim
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _best_match_nb(probe, embs, offsets, weights):
+        n_person = offsets.shape[0] - 1
+        scores = np.empty(n_person, dtype=np.float32)
+        # Люди независимы — считаем их параллельно, скалярное произведение векторизует LLVM
+        for p in prange(n_person):
+            best = -1.0
+            for i in range(offsets[p], offsets[p + 1]):
+                s = 0.0
+                for d in range(embs.shape[1]):
+                    s += embs[i, d] * probe[d]
+                s *= weights[i]
+                if s > best:
+                    best = s
+            scores[p] = best
+        return _top2_nb(scores)
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _best_match_i8_nb(probe, embs, offsets, weights):
+        n_person = offsets.shape[0] - 1
+        scores = np.empty(n_person, dtype=np.float32)
+        inv_scale = 1.0 / (_INT8_SCALE * _INT8_SCALE)
+        for p in prange(n_person):
+            best = -1.0
+            for i in range(offsets[p], offsets[p + 1]):
+                # Целочисленное скалярное произведение int8 x int8 -> int32
+                acc = np.int32(0)
+                for d in range(embs.shape[1]):
+                    acc += np.int32(embs[i, d]) * np.int32(probe[d])
+                s = acc * inv_scale * weights[i]
+                if s > best:
+                    best = s
+            scores[p] = best
+        return _top2_nb(scores)
+
+
+def quantize_embeddings(embs: np.ndarray) -> np.ndarray:
+    """L2-нормализованные векторы float32 -> int8 (масштаб 127): вдвое-вчетверо меньше памяти на проход."""
+    return np.clip(np.rint(np.asarray(embs) * _INT8_SCALE), -127, 127).astype(np.int8)
+
+
+def quantize_gallery(embs: np.ndarray) -> np.ndarray:
+    """
+    База лиц для FACE_MATCH_INT8: int8, если есть Numba. Без Numba сравнение int8 через NumPy
+    на каждое лицо приводит всю базу к int32 — медленнее float32, поэтому база остаётся float32.
+    """
+    if njit is None:
+        log("⚠️ FACE_MATCH_INT8 требует Numba — база лиц остаётся во float32")
+        return embs
+    return quantize_embeddings(embs)
+
+
+def best_match(
+    probe: np.ndarray,
+    embs: np.ndarray,
+    offsets: np.ndarray,
+    weights: np.ndarray,
+):
+    """
+    Ищет лучшего человека для L2-нормализованного probe.
+    Возвращает (idx, best_sim, second_sim); idx = -1, если база пуста.
+    Сходство взвешивается весами векторов weights = conf_weights(confidences).
+    embs может быть int8 (quantize_embeddings) — тогда probe квантуется так же.
+    """
+    if embs.dtype == np.int8:
+        probe = quantize_embeddings(probe)
+        if njit is not None:
+            idx, best_sim, second_sim = _best_match_i8_nb(probe, embs, offsets, weights)
+            return int(idx), float(best_sim), float(second_sim)
+        if len(offsets) < 2:
+            return -1, -1.0, 0.0
+        sims = (embs @ probe.astype(np.int32)).astype(np.float32) / (_INT8_SCALE * _INT8_SCALE)
+        return _top2_np(_person_scores_np(sims, offsets, weights))
+
+    probe = np.ascontiguousarray(probe, dtype=np.float32)
+    embs = np.asarray(embs, dtype=np.float32)  # np.memmap -> обычный ndarray без копирования
+    if njit is not None:
+        idx, best_sim, second_sim = _best_match_nb(probe, embs, offsets, weights)
+        return int(idx), float(best_sim), float(second_sim)
+    if len(offsets) < 2:
+        return -1, -1.0, 0.0
+    return _top2_np(_person_scores_np(embs @ probe, offsets, weights))
+
+
+_lsh_planes: dict[int, np.ndarray] = {}
+
+
+def face_key(emb: np.ndarray) -> int:
+    """
+    Ключ кэша лиц: знаки проекций на FACE_CACHE_LSH_BITS фиксированных случайных векторов (LSH).
+    Близкие векторы (то же лицо на соседних кадрах) с высокой вероятностью дают один ключ, разные люди — разные.
+    """
+    planes = _lsh_planes.get(emb.shape[0])
+    if planes is None:
+        rng = np.random.RandomState(0)
+        planes = rng.standard_normal((emb.shape[0], config.FACE_CACHE_LSH_BITS)).astype(np.float32)
+        _lsh_planes[emb.shape[0]] = planes
+    bits = np.packbits((emb @ planes) > 0)
+    return int.from_bytes(bits.tobytes(), "little")
+
+
+class GalleryIndex:
+    """
+    HNSW-индекс (hnswlib, скалярное произведение) по векторам float32-базы.
+    На лицо берутся k ближайших векторов, по ним — взвешенное сходство и топ-2 по людям.
+    k = (макс. векторов у одного человека) + FACE_ANN_K: даже если все векторы лучшего
+    человека ближе остальных, среди кандидатов остаются векторы других людей и второе
+    сходство (проверка MIN_SIM_DIFF) не теряется. Если другого человека среди кандидатов
+    всё же нет (промах ANN), лицо досчитывается точным best_match().
+    """
+
+    def __init__(self, embs: np.ndarray, offsets: np.ndarray, weights: np.ndarray, k: int):
+        n = embs.shape[0]
+        self._embs = embs
+        self._offsets = offsets
+        self._owner = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        self._weights = weights
+        self._k = k
+        self._index = hnswlib.Index(space="ip", dim=embs.shape[1])
+        self._index.init_index(max_elements=n, ef_construction=200, M=32)
+        self._index.set_num_threads(max(1, config.CPU_THREADS))
+        self._index.add_items(np.asarray(embs, dtype=np.float32), np.arange(n))
+        self._index.set_ef(max(2 * self._k, 64))
+
+    def match_batch(self, probes: np.ndarray):
+        """То же, что best_match_batch(): массивы (idx, best_sim, second_sim) длины F."""
+        labels, dists = self._index.knn_query(np.asarray(probes, dtype=np.float32), k=self._k)
+        labels = labels.astype(np.int64)
+        sims = (1.0 - dists) * self._weights[labels]  # ip-расстояние hnswlib = 1 - <a, b>
+        owners = self._owner[labels]
+
+        n = sims.shape[0]
+        idx = np.empty(n, dtype=np.int64)
+        best = np.empty(n, dtype=np.float32)
+        second = np.zeros(n, dtype=np.float32)
+        for f in range(n):
+            order = np.argsort(sims[f])[::-1]
+            s, o = sims[f, order], owners[f, order]
+            other = o != o[0]
+            if other.any():
+                idx[f], best[f], second[f] = o[0], s[0], s[other.argmax()]
+            else:
+                idx[f], best[f], second[f] = best_match(probes[f], self._embs, self._offsets, self._weights)
+        return idx, best, second
+
+
+def build_index(embs: np.ndarray, offsets: np.ndarray, weights: np.ndarray) -> GalleryIndex | None:
+    """
+    GalleryIndex для большой float32-базы; None — если hnswlib нет, база мала или в int8,
+    или у одного человека столько векторов, что k ближайших — уже половина базы (индекс не окупается).
+    """
+    if hnswlib is None or embs.dtype == np.int8 or embs.ndim != 2 or len(offsets) < 3:
+        return None
+    n = embs.shape[0]
+    if n < max(1, config.FACE_ANN_MIN_EMBEDDINGS):
+        return None
+    k = int(np.diff(offsets).max()) + config.FACE_ANN_K
+    if k > n // 2:
+        log(f"ℹ️ HNSW-индекс базы лиц не строится: на лицо пришлось бы брать {k} из {n} векторов")
+        return None
+    index = GalleryIndex(embs, offsets, weights, k)
+    log(f"✅ HNSW-индекс базы лиц построен ({n} векторов, {k} кандидатов на лицо)")
+    return index
+
+
+def best_match_batch(
+    probes: np.ndarray,
+    embs: np.ndarray,
+    offsets: np.ndarray,
+    weights: np.ndarray,
+    index: GalleryIndex | None = None,
+):
+    """
+    best_match() для всех лиц кадра сразу: probes (F, D), L2-нормализованные.
+    Возвращает массивы (idx, best_sim, second_sim) длины F. Для float32-базы и нескольких лиц —
+    одно матричное умножение (F, D) x (D, N) (SGEMM, база читается один раз на кадр) даже при
+    наличии Numba; ядро Numba — для одного лица и для int8-базы. index (build_index) — поиск
+    по HNSW-индексу вместо полного прохода.
+    """
+    n = probes.shape[0]
+    if index is not None:
+        return index.match_batch(probes)
+    if embs.dtype == np.int8 or (njit is not None and n == 1):
+        res = [best_match(p, embs, offsets, weights) for p in probes]
+        idx = np.array([r[0] for r in res], dtype=np.int64).reshape(n)
+        best = np.array([r[1] for r in res], dtype=np.float32).reshape(n)
+        second = np.array([r[2] for r in res], dtype=np.float32).reshape(n)
+        return idx, best, second
+
+    n_person = len(offsets) - 1
+    if n_person < 1:
+        return np.full(n, -1, dtype=np.int64), np.full(n, -1.0, dtype=np.float32), np.zeros(n, dtype=np.float32)
+
+    sims = np.asarray(probes, dtype=np.float32) @ np.asarray(embs, dtype=np.float32).T
+    sims *= weights
+    scores = np.maximum.reduceat(sims, offsets[:-1], axis=1)  # (F, P)
+    if n_person == 1:
+        return np.zeros(n, dtype=np.int64), scores[:, 0], np.zeros(n, dtype=np.float32)
+
+    top2 = np.argpartition(scores, -2, axis=1)[:, -2:]
+    vals = np.take_along_axis(scores, top2, axis=1)
+    order = np.argsort(vals, axis=1)
+    top2 = np.take_along_axis(top2, order, axis=1)
+    vals = np.take_along_axis(vals, order, axis=1)
+    return top2[:, 1], vals[:, 1], vals[:, 0]
+
+
+def warmup(embs: np.ndarray, offsets: np.ndarray, weights: np.ndarray):
+    """Компилирует ядро под типы массивов базы заранее, чтобы первое лицо не ждало JIT."""
+    if njit is None or embs.ndim != 2:
+        return
+    numba.set_num_threads(max(1, min(config.CPU_THREADS, numba.config.NUMBA_NUM_THREADS)))
+    best_match(np.zeros(embs.shape[1], dtype=np.float32), embs, offsets, weights)
+    log("✅ Ядро сопоставления лиц (Numba) скомпилировано")
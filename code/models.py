@@ -3,12 +3,17 @@
 Инициализация моделей: YOLOv11 и InsightFace (antelopev2).
 """
 
+import functools
 import os
 import sys
-from contextlib import redirect_stdout, redirect_stderr
+from contextlib import nullcontext, redirect_stdout, redirect_stderr
 from io import StringIO
 
+import cv2
+import numpy as np
+import torch
 from insightface.app import FaceAnalysis
+from insightface.utils import face_align
 from ultralytics import YOLO
 
 import config
@@ -31,6 +36,42 @@ class _SuppressOutput:
         self._devnull.close()
 
 
+def _face_gpu_providers(trt_extra: dict | None = None) -> list:
+    """Провайдеры ONNX Runtime для InsightFace на GPU: TensorRT (FACE_TRT) перед CUDA, CPU — запасной."""
+    providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    if config.FACE_TRT:
+        os.makedirs(config.FACE_TRT_CACHE_DIR, exist_ok=True)
+        # Сборка движка TensorRT — минуты; кэш на диске, чтобы это было один раз на модель и размер входа
+        providers.insert(0, ("TensorrtExecutionProvider", {
+            "trt_fp16_enable": True,
+            "trt_engine_cache_enable": True,
+            "trt_engine_cache_path": config.FACE_TRT_CACHE_DIR,
+            **(trt_extra or {}),
+        }))
+    return providers
+
+
+def _rebuild_rec_session_trt(rec):
+    """
+    Пересоздаёт сессию модели распознавания с профилем TensorRT на батч 1..FACE_TRT_MAX_BATCH.
+    Без профиля движок собирается под форму первого вызова, и батч другого размера
+    заставляет TensorRT пересобирать движок прямо во время работы.
+    """
+    import onnxruntime
+
+    w, h = rec.input_size
+    max_batch = config.FACE_TRT_MAX_BATCH
+    opt_batch = min(4, max_batch)  # обычно в кадре 1–4 лица
+    try:
+        rec.session = onnxruntime.InferenceSession(rec.model_file, providers=_face_gpu_providers({
+            "trt_profile_min_shapes": f"{rec.input_name}:1x3x{h}x{w}",
+            "trt_profile_opt_shapes": f"{rec.input_name}:{opt_batch}x3x{h}x{w}",
+            "trt_profile_max_shapes": f"{rec.input_name}:{max_batch}x3x{h}x{w}",
+        }))
+    except Exception as e:
+        log(f"⚠️ Профиль TensorRT для распознавания лиц не применён: {e}")
+
+
 def init_face_analysis():
     """Инициализация InsightFace (antelopev2) с CUDA/CPU fallback."""
     from utils import fix_insightface_model_structure
@@ -50,12 +91,14 @@ def init_face_analysis():
             app = FaceAnalysis(
                 name=config.INSIGHTFACE_MODEL,
                 root=insight_root,
-                providers=["CUDAExecutionProvider", "CPUExecutionProvider"],
+                providers=_face_gpu_providers(),
             )
             # Исправляем структуру сразу ПОСЛЕ создания (если InsightFace только что распаковал)
             fix_insightface_model_structure()
             # Теперь prepare() использует правильную структуру
             app.prepare(ctx_id=0, det_size=det_size)
+        if config.FACE_TRT:
+            _rebuild_rec_session_trt(app.models["recognition"])
         log(f"✅ Система распознавания лиц InsightFace готова (GPU)")
         return app
     except Exception as e:
@@ -77,20 +120,151 @@ def init_face_analysis():
         return app
 
 
+class _BoundRecognizer:
+    """
+    Распознавание InsightFace через IOBinding ONNX Runtime: binding и выходной буфер
+    переиспользуются между кадрами вместо выделения выходов на каждый session.run().
+    """
+
+    def __init__(self, rec):
+        self.rec = rec
+        self.io = rec.session.io_binding()
+        self.output_name = rec.output_names[0]
+        self.dim = rec.session.get_outputs()[0].shape[1]
+        self._out = np.empty((0, self.dim), dtype=np.float32)
+
+    def get_feat(self, imgs: list) -> np.ndarray:
+        """Как ArcFaceONNX.get_feat(); результат — вид на внутренний буфер (до следующего вызова)."""
+        rec = self.rec
+        mean = (rec.input_mean, rec.input_mean, rec.input_mean)
+        blob = cv2.dnn.blobFromImages(imgs, 1.0 / rec.input_std, rec.input_size, mean, swapRB=True)
+        n = blob.shape[0]
+        if self._out.shape[0] < n:
+            self._out = np.empty((max(n, 2 * self._out.shape[0]), self.dim), dtype=np.float32)
+        out = self._out[:n]
+        self.io.bind_cpu_input(rec.input_name, blob)
+        self.io.bind_output(self.output_name, "cpu", 0, np.float32, list(out.shape), out.ctypes.data)
+        rec.session.run_with_iobinding(self.io)
+        return out
+
+
+@functools.lru_cache(maxsize=None)
+def _bound_recognizer(rec):
+    """IOBinding-обёртка модели распознавания (одна на модель); None — если модель не подходит."""
+    try:
+        bound = _BoundRecognizer(rec)
+        if not isinstance(bound.dim, int):
+            return None
+        return bound
+    except Exception as e:
+        log(f"⚠️ IOBinding для распознавания лиц недоступен, обычный session.run(): {e}")
+        return None
+
+
+def face_embeddings(face_app, crops: list, max_num: int = 0) -> list[list[np.ndarray]]:
+    """
+    Векторные представления лиц для списка crop: детекция — по каждому crop,
+    распознавание — одним батч-вызовом на все найденные лица (вместо face_app.get() на crop).
+    Остальные модели FaceAnalysis (пол/возраст, landmarks) не запускаются — они не нужны.
+    Возвращает для каждого crop список векторов (float32, не нормализованы; действительны до следующего вызова).
+    """
+    det = face_app.det_model
+    rec = face_app.models["recognition"]
+    aligned, owners = [], []
+    for i, crop in enumerate(crops):
+        bboxes, kpss = det.detect(crop, max_num=max_num, metric="default")
+        if bboxes.shape[0] == 0 or kpss is None:
+            continue
+        for kps in kpss:
+            aligned.append(face_align.norm_crop(crop, landmark=kps, image_size=rec.input_size[0]))
+            owners.append(i)
+
+    result: list[list[np.ndarray]] = [[] for _ in crops]
+    if aligned:
+        bound = _bound_recognizer(rec)
+        get_feat = bound.get_feat if bound is not None else rec.get_feat
+        if config.FACE_TRT and len(aligned) > config.FACE_TRT_MAX_BATCH:
+            # Батч больше профиля TensorRT — частями (с копией: буфер IOBinding переиспользуется)
+            step = config.FACE_TRT_MAX_BATCH
+            feats = np.concatenate([
+                np.array(get_feat(aligned[i:i + step]), dtype=np.float32) for i in range(0, len(aligned), step)
+            ])
+        else:
+            feats = np.asarray(get_feat(aligned), dtype=np.float32)
+        for i, feat in zip(owners, feats):
+            result[i].append(feat)
+    return result
+
+
+# Постоянный CUDA-поток для YOLO (создаётся один раз вместе с моделью)
+_yolo_cuda_stream = None
+# Устройство для predict() экспортированной модели (PyTorch-модель переносится через model.to())
+_yolo_device = None
+
+# Суффикс файла/папки, который Ultralytics даёт экспортированной модели
+_YOLO_EXPORT_SUFFIX = {"engine": ".engine", "onnx": ".onnx", "openvino": "_openvino_model"}
+
+
+def _export_yolo(path: str) -> str | None:
+    """
+    Экспортирует веса YOLO в YOLO_EXPORT_FORMAT (TensorRT engine / ONNX / OpenVINO) один раз, рядом с .pt.
+    Возвращает путь к экспортированной модели или None — тогда работаем на PyTorch.
+    """
+    fmt = config.YOLO_EXPORT_FORMAT
+    suffix = _YOLO_EXPORT_SUFFIX.get(fmt)
+    if suffix is None:
+        log(f"⚠️ Неизвестный YOLO_EXPORT_FORMAT={fmt}, используется PyTorch-модель")
+        return None
+    target = os.path.splitext(path)[0] + suffix
+    if os.path.exists(target):
+        return target
+
+    gpu = config.YOLO_FORCE_GPU and torch.cuda.is_available()
+    if fmt == "engine" and not gpu:
+        log("⚠️ TensorRT требует GPU, используется PyTorch-модель")
+        return None
+    log(f"📦 Экспорт YOLO в {fmt} (один раз, может занять несколько минут)...")
+    try:
+        return str(YOLO(path).export(
+            format=fmt,
+            imgsz=config.YOLO_IMGSZ,
+            half=config.YOLO_FP16 and gpu,
+            device=0 if gpu else "cpu",
+        ))
+    except Exception as e:
+        log(f"⚠️ Экспорт YOLO не удался ({e}), используется PyTorch-модель")
+        return None
+
+
+@functools.lru_cache(maxsize=1)
 def init_yolo():
-    """Инициализация YOLOv11 модели (GPU → CPU fallback)."""
+    """Инициализация YOLOv11 модели (GPU → CPU fallback). Модель одна на процесс."""
+    global _yolo_cuda_stream, _yolo_device
     log(f"🤖 Инициализация системы обнаружения объектов YOLO ({config.YOLO_MODEL})...")
 
+    # Пул потоков torch (OMP_NUM_THREADS задаётся в main.py до импорта torch)
+    torch.set_num_threads(config.CPU_THREADS)
+
     path = config.YOLO_MODEL
     if not os.path.isabs(path):
         os.makedirs(config.MODEL_DIR, exist_ok=True)
         path = os.path.join(config.MODEL_DIR, config.YOLO_MODEL)
 
-    model = YOLO(path)
+    exported = _export_yolo(path) if config.YOLO_EXPORT_FORMAT else None
 
-    if config.YOLO_FORCE_GPU:
+    if exported:
+        # Инференс в TensorRT / ONNX Runtime / OpenVINO; letterbox и NMS остаются у Ultralytics
+        model = YOLO(exported, task="detect")
+        gpu = (config.YOLO_FORCE_GPU and torch.cuda.is_available()
+               and config.YOLO_EXPORT_FORMAT != "openvino")
+        _yolo_device = 0 if gpu else "cpu"
+        log(f"✅ Система обнаружения объектов YOLO готова ({os.path.basename(exported)}, "
+            f"{'GPU' if gpu else 'CPU'})")
+    elif config.YOLO_FORCE_GPU:
+        model = YOLO(path)
         try:
             model.to("cuda")
+            _yolo_cuda_stream = torch.cuda.Stream()
             # FP16 включаем на стадии predict() (Ultralytics сначала fuse() в FP32)
             log("✅ Система обнаружения объектов YOLO готова (GPU)")
         except Exception as e:
@@ -98,7 +272,58 @@ def init_yolo():
             model.to("cpu")
             log("✅ Система обнаружения объектов YOLO готова (CPU)")
     else:
+        model = YOLO(path)
         model.to("cpu")
         log("✅ Система обнаружения объектов YOLO готова (CPU)")
 
+    # Прогрев: fuse(), выделение памяти CUDA и выбор ядер — до первого настоящего кадра
+    try:
+        yolo_predict(model, np.zeros((config.YOLO_IMGSZ, config.YOLO_IMGSZ, 3), dtype=np.uint8))
+    except Exception as e:
+        log(f"⚠️ Прогрев YOLO не удался: {e}")
+
     return model
+
+
+def yolo_class_filters(model):
+    """
+    Маски по id класса YOLO вместо сравнения строк на каждой детекции:
+    ignore — класс в YOLO_IGNORE_CLASSES, min_conf — порог confidence класса (person или общий).
+    """
+    names = model.names
+    n = max(names) + 1 if names else 0
+    ignore = np.zeros(n, dtype=bool)
+    min_conf = np.full(n, config.YOLO_CONFIDENCE_THRESHOLD, dtype=np.float32)
+    for i, name in names.items():
+        if name in config.YOLO_IGNORE_CLASSES:
+            ignore[i] = True
+        if name == "person":
+            min_conf[i] = config.YOLO_PERSON_CONFIDENCE
+    return ignore, min_conf
+
+
+def yolo_class_names(model):
+    """Имена классов YOLO массивом по id (labels = names[classes]) и id класса person (-1, если нет)."""
+    names = model.names
+    n = max(names) + 1 if names else 0
+    arr = np.array([names.get(i, str(i)) for i in range(n)], dtype=object)
+    person_id = next((i for i, name in names.items() if name == "person"), -1)
+    return arr, person_id
+
+
+def yolo_predict(model, img):
+    """predict() с настройками из config на постоянном CUDA-потоке модели."""
+    ctx = torch.cuda.stream(_yolo_cuda_stream) if _yolo_cuda_stream is not None else nullcontext()
+    kwargs = {} if _yolo_device is None else {"device": _yolo_device}
+    with ctx:
+        results = model.predict(
+            img,
+            imgsz=config.YOLO_IMGSZ,
+            half=config.YOLO_FP16,
+            verbose=False,
+            **kwargs,
+        )
+    if _yolo_cuda_stream is not None:
+        # Вызывающий сразу делает .cpu() на текущем потоке — он должен дождаться потока YOLO
+        torch.cuda.current_stream().wait_stream(_yolo_cuda_stream)
+    return results
@@ -6,44 +6,35 @@
 в отдельную БД home-sentinel (VISION_DB_NAME)
 """
 
-import psycopg2
-
-from config import DB_CONFIG, VISION_DB_NAME
+from config import VISION_DB_NAME
+from database import pooled_connection
 from utils import log
 
 
 def _conn():
-    """Подключение к базе статистики home-sentinel."""
-    cfg = DB_CONFIG.copy()
-    cfg["dbname"] = VISION_DB_NAME
-    return psycopg2.connect(**cfg)
+    """Соединение из пула к базе статистики home-sentinel (commit при выходе из with)."""
+    return pooled_connection(VISION_DB_NAME)
 
 
 def init_tables():
     """Создаёт таблицы статистики, если их ещё нет."""
     try:
-        conn = _conn()
-        cur = conn.cursor()
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS person_stats (
-                id SERIAL PRIMARY KEY,
-                person_name TEXT NOT NULL,
-                seen_at TIMESTAMP NOT NULL DEFAULT NOW()
-            );
-        """)
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS sound_stats (
-                id SERIAL PRIMARY KEY,
-                sound_name TEXT NOT NULL,
-                detected_at TIMESTAMP NOT NULL DEFAULT NOW()
-            );
-        """)
-
-        conn.commit()
-        cur.close()
-        conn.close()
+        with _conn() as conn, conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS person_stats (
+                    id SERIAL PRIMARY KEY,
+                    person_name TEXT NOT NULL,
+                    seen_at TIMESTAMP NOT NULL DEFAULT NOW()
+                );
+            """)
+
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS sound_stats (
+                    id SERIAL PRIMARY KEY,
+                    sound_name TEXT NOT NULL,
+                    detected_at TIMESTAMP NOT NULL DEFAULT NOW()
+                );
+            """)
     except Exception as e:
         log(f"⚠️ Ошибка инициализации таблиц статистики: {e}")
 
@@ -51,15 +42,11 @@ def init_tables():
 def record_person_seen(name: str):
     """Записывает факт появления человека."""
     try:
-        conn = _conn()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO person_stats (person_name, seen_at) VALUES (%s, NOW())",
-            (name,),
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        with _conn() as conn, conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO person_stats (person_name, seen_at) VALUES (%s, NOW())",
+                (name,),
+            )
     except Exception as e:
         log(f"⚠️ Ошибка записи person_stats: {e}")
 
@@ -67,14 +54,10 @@ def record_person_seen(name: str):
 def record_sound_detected(sound: str):
     """Записывает факт обнаружения звука."""
     try:
-        conn = _conn()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO sound_stats (sound_name, detected_at) VALUES (%s, NOW())",
-            (sound,),
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        with _conn() as conn, conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO sound_stats (sound_name, detected_at) VALUES (%s, NOW())",
+                (sound,),
+            )
     except Exception as e:
         log(f"⚠️ Ошибка записи sound_stats: {e}")
@@ -12,12 +12,52 @@ import numpy as np
 
 import config
 
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+except ImportError:  # PyTurboJPEG опционален: без него кодирует OpenCV
+    TurboJPEG = None
+
+_turbojpeg = None
+_clahe = None  # CLAHE для preprocess_face_crop (создаётся один раз)
+
 
 def log(msg: str):
     """Стандартный логгер с timestamp."""
     print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {msg}", flush=True)
 
 
+def _get_turbojpeg():
+    """Один экземпляр TurboJPEG на процесс (загрузка libturbojpeg); None — если недоступен."""
+    global _turbojpeg
+    if _turbojpeg is None and TurboJPEG is not None and config.SCREENSHOT_ENCODER == "turbojpeg":
+        try:
+            _turbojpeg = TurboJPEG()
+        except Exception as e:
+            log(f"⚠️ libturbojpeg недоступна, JPEG кодирует OpenCV: {e}")
+            _turbojpeg = False
+    return _turbojpeg or None
+
+
+def encode_jpeg(frame: np.ndarray, quality: int | None = None) -> bytes:
+    """Кодирует BGR-кадр в JPEG (libjpeg-turbo, если есть, иначе cv2.imencode)."""
+    if quality is None:
+        quality = config.SCREENSHOT_JPEG_QUALITY
+    tj = _get_turbojpeg()
+    if tj is not None:
+        return tj.encode(frame, quality=quality, pixel_format=TJPF_BGR)
+    ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("cv2.imencode не смог закодировать кадр")
+    return buf.tobytes()
+
+
+def save_jpeg(path: str, frame: np.ndarray, quality: int | None = None):
+    """Сохраняет BGR-кадр в JPEG-файл через encode_jpeg()."""
+    data = encode_jpeg(frame, quality)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
 def fix_insightface_model_structure():
     """Исправляет неправильную структуру папок модели InsightFace.
     Проблема: архив antelopev2.zip содержит вложенную папку antelopev2,
@@ -103,14 +143,19 @@ def _l2_normalize(v: np.ndarray, eps: float = 1e-9) -> np.ndarray:
 
 
 def preprocess_face_crop(crop: np.ndarray) -> np.ndarray:
-    """Предобработка изображения лица: CLAHE для улучшения контраста."""
+    """
+    Предобработка изображения лица: CLAHE для улучшения контраста.
+    Один новый буфер на crop: LAB считается в него же и обратно в BGR конвертируется на месте.
+    """
+    global _clahe
     if crop.size == 0:
         return crop
     try:
+        if _clahe is None:
+            _clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
         lab = cv2.cvtColor(crop, cv2.COLOR_BGR2LAB)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        lab[:, :, 0] = clahe.apply(lab[:, :, 0])
-        return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+        cv2.insertChannel(_clahe.apply(cv2.extractChannel(lab, 0)), lab, 0)
+        return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=lab)
     except Exception:
         return crop
 